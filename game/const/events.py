@@ -10,6 +10,8 @@ UPDATE_PLAYER_LOOK_SENSITIVITY = "update_player_look_sensitivity"
 
 # Networking events
 NETWORK_SEND_PRIORITY_EVENT = "network_priority"
+QUEUE_JOINED_EVENT = "queue_joined"
+QUEUE_MATCH_FOUND_EVENT = "queue_match_found"
 
 # Gui events
 GUI_RETURN_EVENT = "gui_return"
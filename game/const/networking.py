@@ -7,4 +7,53 @@ HOST = "pyweek-39.ssh-coffee.dev"
 HOST_IS_SECURE = True
 
 TIME_BETWEEN_PACKAGES_IN_S = 0.05
+# Adaptive state send rate, see SendRateController
+SEND_INTERVAL_COMBAT_S = 1 / 30
+SEND_INTERVAL_DEFAULT_S = TIME_BETWEEN_PACKAGES_IN_S
+SEND_INTERVAL_FAR_S = 0.1
+SEND_INTERVAL_IDLE_S = 0.25
+# Same range the bot starts attacking at
+COMBAT_DISTANCE = 7
+FAR_DISTANCE = 14
+# No movement or mouse look for this long counts as idle
+IDLE_AFTER_S = 0.25
+# Intervals are stretched by rtt / threshold (or send duration / threshold), at most by the factor
+RTT_BACKOFF_THRESHOLD_S = 0.2
+SEND_DURATION_BACKOFF_THRESHOLD_S = 0.005
+MAX_SEND_BACKOFF_FACTOR = 3
+PACKET_RATE_LOG_INTERVAL_S = 10
+
+# Round trip measurement, pings without pong after the timeout count as lost
+PING_INTERVAL_S = 1
+PING_TIMEOUT_S = 5
+# Send only changed, quantized fields instead of full snapshots (receivers understand both)
+USE_DELTA_COMPRESSION = True
+# Full state is resent this often so a receiver that lost track recovers
+DELTA_KEYFRAME_INTERVAL_S = 1.0
+
+# Received messages are buffered by the network thread and handled once per frame
+RECEIVE_BUFFER_SIZE = 1024
+RECEIVE_BUFFER_WAIT_S = 0.005
+# Upper bound of handled messages per frame, the rest waits for the next frame
+MAX_MESSAGES_PER_FRAME = 64
+
+# Queue status requests are held open by the server until the status changes or this passes
+QUEUE_LONG_POLL_S = 20
+QUEUE_RETRY_DELAY_S = 1
+# Joining a busy server is retried with jittered exponential backoff, at least as long as its Retry-After
+JOIN_QUEUE_MAX_ATTEMPTS = 5
+JOIN_QUEUE_BASE_DELAY_S = 1
+JOIN_QUEUE_MAX_DELAY_S = 30
+# Blocking http requests run on this threaded task chain instead of the render thread
+NETWORK_TASK_CHAIN = "network_chain"
+# One thread is held by the queue long poll, the other serves join/leave requests
+NETWORK_TASK_CHAIN_THREADS = 2
 POSITION_DIFF_THRESHOLD = 0.1
+
+# Remote movement is rendered this far in the past, interpolating between timestamped snapshots.
+# Has to cover the send interval plus jitter, packets without a match time fall back to correction above
+USE_SNAPSHOT_INTERPOLATION = True
+INTERPOLATION_DELAY_S = 0.1
+# Past the newest snapshot the last movement is continued at most this long
+MAX_EXTRAPOLATION_S = 0.25
+SNAPSHOT_BUFFER_SIZE = 32
@@ -1,10 +1,11 @@
 from typing import List
-from game.const.events import GUI_UPDATE_LATENCY, NETWORK_SEND_PRIORITY_EVENT
-from game.const.networking import POSITION_DIFF_THRESHOLD
+from game.const.events import NETWORK_SEND_PRIORITY_EVENT
+from game.const.networking import INTERPOLATION_DELAY_S, MAX_EXTRAPOLATION_S, POSITION_DIFF_THRESHOLD, SNAPSHOT_BUFFER_SIZE, USE_SNAPSHOT_INTERPOLATION
 from game.const.player import DASH_SPEED, GRAVITY, JUMP_VELOCITY
 from game.entities.base_entity import EntityBase
 from game.helpers.config import is_attacker_authority
 from game.helpers.helpers import *
+from game.networking.snapshot_buffer import Snapshot, SnapshotBuffer
 from panda3d.core import Vec3, Vec2, TextNode
 from shared.types.player_info import PlayerAction, PlayerInfo
 from game.utils.name_generator import generate_name
@@ -21,6 +22,14 @@ class AntiPlayer(EntityBase):
 
         self.movement_vector = Vec3(0,0,0)
         self.correction_vector = Vec3(0,0,0)
+        self.network_position: Vec2 | None = None
+        # Last known remote transform, delta packets only contain what changed
+        self.network_heading = 0.0
+        self.network_pitch = 0.0
+        self.network_movement = Vec2(0,0)
+        self.snapshots: SnapshotBuffer | None = None
+        if is_puppet and USE_SNAPSHOT_INTERPOLATION:
+            self.snapshots = SnapshotBuffer(SNAPSHOT_BUFFER_SIZE, INTERPOLATION_DELAY_S, MAX_EXTRAPOLATION_S)
 
         self.accept("q", self.debug_stab)
         self.accept("e", self.debug_block)
@@ -60,7 +69,6 @@ class AntiPlayer(EntityBase):
             self.vertical_velocity = JUMP_VELOCITY
             return
         offset = self.match_timer - start_time
-        messenger.send(GUI_UPDATE_LATENCY, [offset * 1000])
         # calc current jump pos based on time offset
         # base velocity - gravity * offset
         self.vertical_velocity = JUMP_VELOCITY - (GRAVITY * offset)
@@ -85,7 +93,6 @@ class AntiPlayer(EntityBase):
             self.__sweep_safe(sweep_animation_no=sweep_animation_no)
             return
         offset = self.match_timer - start_time
-        messenger.send(GUI_UPDATE_LATENCY, [offset * 1000])
         start_frame = int(offset * 24)
         self.logger.debug(f"Block started at frame {start_frame}")
         self.__sweep_safe(sweep_animation_no=sweep_animation_no, frame_offset=start_frame)
@@ -114,7 +121,6 @@ class AntiPlayer(EntityBase):
             self.__block_safe()
             return
         offset = self.match_timer - start_time
-        messenger.send(GUI_UPDATE_LATENCY, [offset * 1000])
         start_frame = int(offset * 24)
         self.logger.debug(f"Block started at frame {start_frame}")
         self.__block_safe(start_frame)
@@ -151,7 +157,6 @@ class AntiPlayer(EntityBase):
             self.__stab_safe()
             return
         offset = self.match_timer - start_time
-        messenger.send(GUI_UPDATE_LATENCY, [offset * 1000])
         start_frame = int(offset * 24)
         self.logger.debug(f"Stab started at frame {start_frame}")
         self.__stab_safe(start_frame)
@@ -194,8 +199,30 @@ class AntiPlayer(EntityBase):
             self.logger.debug("Network update enemy health")
             self.take_damage(self.health - update.health)
         if update.position is not None:
+            self.network_position = Vec2(update.position.x, update.position.y)
+        if update.movement is not None:
+            self.network_movement = Vec2(update.movement.x, update.movement.y)
+        if update.lookRotation is not None:
+            self.network_pitch = update.lookRotation
+        if update.bodyRotation is not None:
+            self.network_heading = update.bodyRotation
+        if self.snapshots is not None and update.match_time is not None and self.network_position is not None:
+            self.snapshots.push(Snapshot(
+                update.match_time,
+                self.network_position.x,
+                self.network_position.y,
+                self.network_heading,
+                self.network_pitch,
+                self.network_movement.x,
+                self.network_movement.y,
+            ), self.match_timer)
+        if self.is_interpolating():
+            # Transform is sampled from the snapshot buffer in update
+            return
+        # Delta packets leave out an unchanged position, keep correcting towards the last known one
+        if self.network_position is not None:
             # Use the locally calculated z coord to stop slight jittering midair
-            networkPos = Vec3(update.position.x, update.position.y, self.body.getZ())
+            networkPos = Vec3(self.network_position.x, self.network_position.y, self.body.getZ())
             network_to_local_delta = (networkPos - self.body.getPos())
             # Hard correction
             if  network_to_local_delta.length() > (POSITION_DIFF_THRESHOLD * 2):
@@ -216,12 +243,28 @@ class AntiPlayer(EntityBase):
         if update.bodyRotation is not None:
             self.body.setH(update.bodyRotation)
 
+    def is_interpolating(self) -> bool:
+        return self.snapshots is not None and len(self.snapshots) > 0
+
+    def __apply_snapshot(self, dt):
+        snapshot = self.snapshots.sample(self.match_timer)
+        if self.is_dashing:
+            direction = self.body.getRelativeVector(self.head, Vec3.forward())
+            self.vertical_velocity = direction.z * DASH_SPEED
+        # Horizontal transform comes from the remote (dashes included), height stays local to avoid jitter midair
+        self.body.setFluidPos(snapshot.x, snapshot.y, self.body.getZ() + self.vertical_velocity * dt)
+        self.body.setH(snapshot.heading)
+        self.head.setP(snapshot.pitch)
+
     def update(self, dt, player_pos=None):
         super().update(dt)
         if self.body.is_empty():
             return
         self.match_timer += dt
         self.apply_gravity(dt)
+        if self.is_interpolating():
+            self.__apply_snapshot(dt)
+            return
         flat_move = Vec2(self.movement_vector.x, self.movement_vector.y)
         if self.is_dashing:
             direction = self.body.getRelativeVector(self.head, Vec3.forward())
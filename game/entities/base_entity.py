@@ -1,6 +1,5 @@
 import logging
 from typing import ForwardRef
-from direct.actor.Actor import Actor
 from direct.showbase import DirectObject
 from abc import abstractmethod
 import math
@@ -13,18 +12,61 @@ from game.const.bit_masks import ANTI_PLAYER_BIT_MASK, NO_BIT_MASK, PLAYER_BIT_M
 from game.const.events import DEFEAT_EVENT, GUI_UPDATE_ANTI_HP, GUI_UPDATE_PLAYER_HP, NETWORK_SEND_PRIORITY_EVENT, WIN_EVENT
 from game.const.player import ALLOWED_WORD_CENTER_DISTANCE, BASE_HEALTH, BLOCK_RANGE_DEG, GRAVITY, MOVEMENT_SPEED, PLAYER_1_SPAWN, PLAYER_2_SPAWN, POST_HIT_INV_DURATION, WORLD_CENTER_POINT
 from game.helpers.config import is_attacker_authority
-from game.helpers.helpers import getModelPath
 from panda3d.core import Vec3, CollisionNode, CollisionSphere, CollisionCapsule, CollisionHandlerEvent, LineSegs, NodePath, Mat3,Quat
 
+from game.utils.model_cache import get_actor, preload_actor
 from game.utils.scene_graph import traverse_parents_until_name_is_matched
-from direct.particles.ParticleEffect import ParticleEffect
 from game.helpers.helpers import *
 import random
 
-from game.utils.sound import add_3d_sound_to_node
+from game.utils.particles import PARTICLE_POOL
+from game.utils.sound import SOUND_BANK
 from shared.types.player_info import PlayerAction, PlayerInfo
 from shared.types.status_message import StatusMessages
 
+# Animation name -> model name
+SWORD_ANIMATIONS = {
+    "stab": "sword-Stab",
+    "block1": "sword-Block",
+    "block2": "sword-Block2",
+    "being-blocked": "sword-being-blocked",
+    "sweep1": "sword-Sweep",
+    "sweep2": "sword-Sweep2",
+    "sweep3": "sword-Sweep3",
+}
+
+def preload_entity_models():
+    """Load everything __construct needs up front, entities are then built from cached copies"""
+    preload_actor("body")
+    preload_actor("head")
+    preload_actor("sword", SWORD_ANIMATIONS)
+    preload_actor("shoes")
+
+SWEEP_SOUNDS = [f"swipe{i+1}" for i in range(7)]
+HIT_SOUNDS = [f"hit{i+1}" for i in range(4)]
+
+def preload_entity_sounds():
+    """Load every sound a fight can play so the first swing does not decode from disk"""
+    SOUND_BANK.preload(SWEEP_SOUNDS + HIT_SOUNDS + ["stab", "blocked_hit"])
+    # The opponent is heard positionally
+    SOUND_BANK.preload(SWEEP_SOUNDS + ["stab"], is_3d=True)
+
+BLOOD_EFFECTS = 4
+BLOOD_LIFETIME_S = 1.0
+# One splash is started per frame while dashing over water, each keeps emitting for a second
+DASH_SPLASH_EFFECTS = 24
+DASH_SPLASH_LIFETIME_S = 1.0
+
+def __configure_dash_splash(effect):
+    effect.setShaderOff()
+    effect.setDepthWrite(False)
+    effect.setBin("fixed", 0)
+
+def preload_entity_particles():
+    """Create the pooled hit and dash effects, nothing is read from disk during a fight"""
+    PARTICLE_POOL.preload("blood2", BLOOD_EFFECTS, lambda effect: effect.setShaderOff())
+    PARTICLE_POOL.preload("water_dash2", DASH_SPLASH_EFFECTS, __configure_dash_splash)
+
 class EntityBase(DirectObject.DirectObject):
     def __init__(self, window, id: str, online: bool, name="BaseEntity"):
         super().__init__()
@@ -45,7 +87,6 @@ class EntityBase(DirectObject.DirectObject):
         self.is_dashing = False
         self.hit_handled = False
         self.is_block_stunned = False
-        self.dashParticles = []
 
         self.block_animations = ["block1", "block2"]
         
@@ -89,12 +130,8 @@ class EntityBase(DirectObject.DirectObject):
         self.particle_owner.setShaderOff()
 
     def setupSounds(self):
-        self.sweepingSounds = []
-        self.hitSounds = []
-        for i in range(7):
-            self.sweepingSounds.append(base.loader.loadSfx(getSoundPath("swipe"+str(i+1))))
-        for i in range(4):
-            self.hitSounds.append(base.loader.loadSfx(getSoundPath("hit"+str(i+1))))
+        # Voices are shared through the sound bank, this only makes sure they are loaded
+        preload_entity_sounds()
 
     def set_player(self, playerId: StatusMessages):
         assert playerId in [StatusMessages.PLAYER_1, StatusMessages.PLAYER_2]
@@ -107,7 +144,7 @@ class EntityBase(DirectObject.DirectObject):
         self.body.setH(180)
     
     def __construct(self):
-        self.body = Actor(getModelPath("body"))
+        self.body = get_actor("body")
         self.body.setName("body")
         self.body.reparentTo(render)
         
@@ -116,7 +153,7 @@ class EntityBase(DirectObject.DirectObject):
         self.bodyHitBoxNodePath.node().addSolid(bodyHitBox)
         self.bodyHitBoxNodePath.setCollideMask(self.own_collision_mask)
         
-        self.head = Actor(getModelPath("head"))
+        self.head = get_actor("head")
         self.head.reparentTo(self.body)
         self.head.setPos(0,0,0.52)
         head_joint = self.head.exposeJoint(None, "modelRoot", "Bone")
@@ -138,13 +175,7 @@ class EntityBase(DirectObject.DirectObject):
         self.headHitBoxBlockedNodePath.setCollideMask(NO_BIT_MASK)
         self.headHitBoxBlockedNodePath.reparentTo(head_joint)
         
-        self.sword = Actor(getModelPath("sword"),{"stab":getModelPath("sword-Stab"),
-                                                  "block1":getModelPath("sword-Block"),
-                                                  "block2":getModelPath("sword-Block2"),
-                                                  "being-blocked":getModelPath("sword-being-blocked"),
-                                                  "sweep1":getModelPath("sword-Sweep"),
-                                                  "sweep2":getModelPath("sword-Sweep2"),
-                                                  "sweep3":getModelPath("sword-Sweep3")})
+        self.sword = get_actor("sword", SWORD_ANIMATIONS)
         self.sword.reparentTo(self.head)
         
         sword_joint = self.sword.exposeJoint(None, "modelRoot", "Bone")
@@ -158,7 +189,7 @@ class EntityBase(DirectObject.DirectObject):
                
         self.sword.setPos(0, 0.35, 0)
     
-        self.shoes = Actor(getModelPath("shoes"))
+        self.shoes = get_actor("shoes")
         self.shoes.reparentTo(self.body)
         self.body.setPos(0, 0, 0.5)
         
@@ -170,15 +201,13 @@ class EntityBase(DirectObject.DirectObject):
     
     def playSound(self,name, is_3d=False):
         if name == "sweep":
-            sound = random.choice(self.sweepingSounds)
+            name = random.choice(SWEEP_SOUNDS)
         elif name == "hit":
-            sound = random.choice(self.hitSounds)
-        else:
-            sound = base.loader.loadSfx(getSoundPath(name))
+            name = random.choice(HIT_SOUNDS)
         if not is_3d:
-            sound.play()
+            SOUND_BANK.play(name)
             return 
-        add_3d_sound_to_node(sound.getName(), self.body, loops=False)
+        SOUND_BANK.play_3d(name, self.body)
     
     def playSoundLater(self, name, is_3d=False):
         self.playSound(name, is_3d)
@@ -216,21 +245,14 @@ class EntityBase(DirectObject.DirectObject):
 
     def show_sword_hit(self, start, direction):
         self.playSound("hit")
-        p = ParticleEffect()
-        p.setShaderOff()
-        p.loadConfig(getParticlePath("blood2"))
-        p.setPos(start)
-        
-        p0 = p.getParticlesList()[0]  # Get the first particle system
-        emitter = p0.getEmitter()
-        
-        emitter.setExplicitLaunchVector(direction)
-        
-        p.setScale(1)
-        p.start(parent = self.particle_owner, renderParent = self.particle_owner)
-
+        p = PARTICLE_POOL.acquire("blood2", self.particle_owner, BLOOD_LIFETIME_S)
+        if p is not None:
+            p.setPos(start)
+            p0 = p.getParticlesList()[0]  # Get the first particle system
+            p0.getEmitter().setExplicitLaunchVector(direction)
 
-        taskMgr.doMethodLater(1, self.hitOver,"hitOver", extraArgs=[p], appendTask=True)
+        # The pool takes the blood back on its own
+        self.reset_hit_handled_later(1)
 
     def handle_hit(self, event):
         
@@ -261,11 +283,12 @@ class EntityBase(DirectObject.DirectObject):
     def continueStrike(self,animName,frame,task):
         self.sword.play(animName,fromFrame=frame)
         
-    def hitOver(self,blood,task):
+    def reset_hit_handled_later(self, delay):
+        taskMgr.doMethodLater(delay, self.hitOver, "hitOver")
+
+    def hitOver(self, task):
         self.hit_handled = False
-        if blood is not None:
-            blood.cleanup()
-            blood.removeNode()
+        return task.done
 
     def take_damage(self, damage_value: int, force = False):
         # Player only takes damage after network said so
@@ -358,7 +381,7 @@ class EntityBase(DirectObject.DirectObject):
         taskMgr.remove(f"{self.id}-endBlockTask")
         self.endBlock(None) 
         self.play_blocked_animation(frame_offset)
-        taskMgr.doMethodLater(0.5, self.hitOver,"hitOver", extraArgs=[None], appendTask=True)
+        self.reset_hit_handled_later(0.5)
 
         if self.id == "player" and self.online and is_attacker_authority():
             messenger.send(NETWORK_SEND_PRIORITY_EVENT, [PlayerInfo(actions=[PlayerAction.GOT_BLOCKED], action_offsets=[self.match_timer])])
@@ -382,12 +405,6 @@ class EntityBase(DirectObject.DirectObject):
     def end_dash(self,task):
         self.is_dashing = False
         self.vertical_velocity = -0.01
-        taskMgr.doMethodLater(1, self.cleanUpParticles, "cleanUpSplashTask")
-    
-    def cleanUpParticles(self,task):
-        for p in self.dashParticles:
-            p.cleanup()
-        self.dashParticles = []
     def start_match_timer(self):
         self.match_timer = 0.0
 
@@ -468,18 +485,10 @@ class EntityBase(DirectObject.DirectObject):
             # 6 16
             # 6 -8
             # -5,5 -8
-            p = ParticleEffect()
-            p.setShaderOff()
-            p.loadConfig(getParticlePath("water_dash2"))
-
-            # Ensure the renderer is set before initialization
-            p0 = p.getParticlesList()[0]  # Get the first particle system
-            p.start(parent=self.particle_owner, renderParent=self.particle_owner)
-            p.setDepthWrite(False)
-            p.setBin("fixed", 0)
-            p.setPos(self.body.getPos()) 
-
-            self.dashParticles.append(p)
+            # Recycles the oldest splash once all are running, so a long dash costs the same every frame
+            p = PARTICLE_POOL.acquire("water_dash2", self.particle_owner, DASH_SPLASH_LIFETIME_S)
+            if p is not None:
+                p.setPos(self.body.getPos())
             
         if self.inv_phase > 0.0:
             self.inv_phase -= dt
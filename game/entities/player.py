@@ -177,4 +177,5 @@ class Player(EntityBase):
             lookRotation=self.head.getP(),
             bodyRotation=self.body.getH(),
             movement=Vector(movement_vec.x, movement_vec.y, movement_vec.z, movement_vec.length()),
+            match_time=self.match_timer,
         )
@@ -54,8 +54,13 @@ class Hud(GuiBase):
         self.accept(GUI_UPDATE_LATENCY, self.__update_latency)
         self.accept(GUI_UPDATE_ANTI_PLAYER_NAME, self.anti_hp_bar.update_name)
 
-    def __update_latency(self, time_ms: float):
+    def __update_latency(self, time_ms: float, jitter_ms: float | None = None, loss: float | None = None):
         try:
-            self.latency_indicator.setText(f"Ping: ~{time_ms:6.2f}ms")
+            text = f"Ping: ~{time_ms:.0f}ms"
+            if jitter_ms is not None:
+                text += f" ±{jitter_ms:.0f}"
+            if loss:
+                text += f" ({loss:.0%} loss)"
+            self.latency_indicator.setText(text)
         except Exception as e:
             self.logger.error(f"Error occured updating ping display: {e}")
@@ -1,14 +1,58 @@
 
+import hashlib
+import json
+import logging
 from os.path import join
-from panda3d.core import Filename
+from panda3d.core import Filename, PandaSystem
 
 from direct.showbase.PythonUtil import os
 
 from panda3d.core import Vec3
 
+# Written by scripts/bake_models.py, egg checksums the baked .bam files were made from and the Panda version that wrote them
+BAM_MANIFEST_NAME = "bam_manifest.json"
+
+# name -> resolved path, every model is only checked once per run
+__model_paths = dict()
+__bam_manifest = None
+
+def __load_bam_manifest(models_dir):
+    global __bam_manifest
+    if __bam_manifest is None:
+        try:
+            with open(os.path.join(models_dir, BAM_MANIFEST_NAME)) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            manifest = {}
+        __bam_manifest = manifest.get("models", {})
+        # Bam files are only guaranteed to load with the Panda version that wrote them
+        if __bam_manifest and manifest.get("panda_version") != PandaSystem.getVersionString():
+            logging.getLogger(__name__).info(f"Models were baked with Panda {manifest.get('panda_version')}, this is {PandaSystem.getVersionString()}, loading the eggs")
+            __bam_manifest = {}
+    return __bam_manifest
+
+def __is_baked(models_dir, name) -> bool:
+    """True if the .bam was baked from the egg that is there now"""
+    bam_path = os.path.join(models_dir, name+".bam")
+    egg_path = os.path.join(models_dir, name+".egg")
+    if (checksum := __load_bam_manifest(models_dir).get(name)) is None or not os.path.exists(bam_path):
+        return False
+    # Builds ship without eggs, build_apps converts them itself and the loader finds its .bam through the .egg name
+    if not os.path.exists(egg_path):
+        return False
+    with open(egg_path, "rb") as file:
+        if hashlib.sha256(file.read()).hexdigest() == checksum:
+            return True
+    logging.getLogger(__name__).info(f"Baked {name}.bam is outdated, loading {name}.egg instead")
+    return False
+
 def getModelPath(name):
-    file_path = os.path.join(os.getcwd(), "assets", "models", name+".egg")
-    return Filename.fromOsSpecific(file_path).getFullpath()
+    """Baked .bam if it is up to date, the .egg otherwise"""
+    if name not in __model_paths:
+        models_dir = os.path.join(os.getcwd(), "assets", "models")
+        file_path = os.path.join(models_dir, name+(".bam" if __is_baked(models_dir, name) else ".egg"))
+        __model_paths[name] = Filename.fromOsSpecific(file_path).getFullpath()
+    return __model_paths[name]
 
 def getImagePath(name):
     file_path = os.path.join(os.getcwd(), "assets", "images", name+".png")
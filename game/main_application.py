@@ -9,10 +9,11 @@ import copy
 
 from game.gui.const import GuiStates, StateTransitionEvents
 
-from game.const.events import CANCEL_QUEUE_EVENT, DEFEAT_EVENT, ENTER_QUEUE_EVENT, GUI_FORCE_MAIN_MENU_EVENT, GUI_MAIN_MENU_EVENT, GUI_PLAY_EVENT, GUI_QUEUE_EVENT, GUI_RETURN_EVENT, GUI_SETTINGS_EVENT, GUI_UPDATE_ANTI_PLAYER_NAME, NETWORK_SEND_PRIORITY_EVENT, RESET_PLAYER_CAMERA, START_GAME_EVENT, UPDATE_SHADOW_SETTINGS, WIN_EVENT
-from game.const.networking import TIME_BETWEEN_PACKAGES_IN_S
+from game.const.events import CANCEL_QUEUE_EVENT, DEFEAT_EVENT, ENTER_QUEUE_EVENT, GUI_FORCE_MAIN_MENU_EVENT, GUI_MAIN_MENU_EVENT, GUI_PLAY_EVENT, GUI_QUEUE_EVENT, GUI_RETURN_EVENT, GUI_SETTINGS_EVENT, GUI_UPDATE_ANTI_PLAYER_NAME, GUI_UPDATE_LATENCY, NETWORK_SEND_PRIORITY_EVENT, QUEUE_JOINED_EVENT, QUEUE_MATCH_FOUND_EVENT, RESET_PLAYER_CAMERA, START_GAME_EVENT, UPDATE_SHADOW_SETTINGS, WIN_EVENT
+from game.const.networking import MAX_MESSAGES_PER_FRAME, NETWORK_TASK_CHAIN, NETWORK_TASK_CHAIN_THREADS, QUEUE_LONG_POLL_S, QUEUE_RETRY_DELAY_S
 from game.const.player import MAIN_MENU_CAMERA_HEIGHT, MAIN_MENU_CAMERA_ROTATION_RADIUS, MAIN_MENU_CAMERA_ROTATION_SPEED, MAIN_MENU_PLAYER_POSITION
 from game.entities.anti_player import AntiPlayer
+from game.entities.base_entity import preload_entity_models, preload_entity_particles, preload_entity_sounds
 from game.entities.bot import Bot
 from game.entities.player import Player
 from game.helpers.config import get_player_name, load_config, is_attacker_authority
@@ -20,17 +21,20 @@ from game.helpers.helpers import *
 from game.gui.gui_manager import GuiManager
 import uuid
 
-from game.networking.queue import check_queue_status, join_queue, leave_queue
+from game.networking.queue import check_queue_status, close_client, join_queue, leave_queue, run_in_background
 from game.networking.websocket import MatchWS
+from game.networking.send_rate import SendRateController
 from game.utils.input import disable_mouse, enable_mouse
+from game.utils.model_cache import get_actor
 from game.utils.name_generator import generate_name
-from game.utils.sound import add_3d_sound_to_node
+from game.utils.profiler import FRAME_PROFILER
+from game.utils.sound import SOUND_BANK, add_3d_sound_to_node
 from shared.const.queue_status import QueueStatus
 from pandac.PandaModules import WindowProperties
 
 from shared.types.player_info import PlayerInfo
 from shared.types.status_message import StatusMessages
-from shared.utils.validation import parse_game_status, parse_player_info
+from shared.utils.validation import parse_game_status
 
 from direct.particles.ParticleEffect import ParticleEffect
 from direct.actor.Actor import Actor
@@ -83,6 +87,12 @@ class MainGame(ShowBase):
         self.accept(RESET_PLAYER_CAMERA, self.__position_player_camera)
 
         self.accept(NETWORK_SEND_PRIORITY_EVENT, self.__priority_ws_send)
+        self.accept(QUEUE_JOINED_EVENT, self.__queue_joined)
+        self.accept(QUEUE_MATCH_FOUND_EVENT, self.__match_found)
+
+        # Http requests block until the server answers, keep them away from the render thread
+        base.taskMgr.setupTaskChain(NETWORK_TASK_CHAIN, numThreads=NETWORK_TASK_CHAIN_THREADS)
+        self.is_queued = False
 
         self.player_id: str = str(uuid.uuid4())
         self.match_id: None | str = None
@@ -91,12 +101,27 @@ class MainGame(ShowBase):
         self.ws: None | MatchWS = None
 
         self.time_since_last_package: int = 1_000_000
+        self.send_rate = SendRateController()
         self.camera_angle = 0
 
         self.slight = None
 
         self.buildMap()
 
+        # Frame time per subsystem, engine tasks are measured by Panda already
+        FRAME_PROFILER.watch_tasks("main loop", ["gameLoop"])
+        FRAME_PROFILER.watch_tasks("collisions", ["collisionLoop"])
+        FRAME_PROFILER.watch_tasks("particles", ["manager-update"])
+        FRAME_PROFILER.watch_tasks("render", ["igLoop"])
+        FRAME_PROFILER.watch_tasks("tex scroll", ["shift river Task"] + [f"shift Task{i + 1}" for i in range(self.waterfallCount)])
+        FRAME_PROFILER.configure_from_env()
+        self.accept("f3", FRAME_PROFILER.toggle)
+
+    def finalizeExit(self):
+        close_client()
+        FRAME_PROFILER.disable()
+        super().finalizeExit()
+
     def __force_main_menu(self):
         if self.gui_manager.is_ingame():
             self.__finish_game(False, fast_exit=True)
@@ -144,7 +169,7 @@ class MainGame(ShowBase):
         self.spaceSkyBox.setLightOff()
         #self.spaceSkyBox.setTexture(cubeMap, 1)
         
-        self.map = self.loader.loadModel("assets/models/map.egg")
+        self.map = self.loader.loadModel(getModelPath("map"))
         
         self.map.reparentTo(self.render)
         
@@ -201,6 +226,11 @@ class MainGame(ShowBase):
             p.setBin("fixed", 0)
 
         self.__add_and_focus_main_menu_player()
+        # Match start only copies the cached entity models
+        preload_entity_models()
+        preload_entity_sounds()
+        preload_entity_particles()
+        SOUND_BANK.preload(["vicroy"], voices=1)
 
         '''
         color = (0.5, 0.5, 0.5)
@@ -258,7 +288,7 @@ class MainGame(ShowBase):
         self.logger.info("Place camera and player")
         if self.player is not None:
             self.player.destroy()
-        self.player = Actor(getModelPath("idle_actor"),{"idle": getModelPath("idle_actor-Idle")})
+        self.player = get_actor("idle_actor", {"idle": "idle_actor-Idle"})
         self.player.setPos(MAIN_MENU_PLAYER_POSITION)
         self.player.loop("idle")
         
@@ -282,6 +312,8 @@ class MainGame(ShowBase):
        
         if self.ws is not None:
             self.ws.close(reason="Finished")
+            # Anything still buffered belongs to the finished match
+            self.ws = None
         if self.ws_handle_task is not None:
             self.ws_handle_task.cancel()
             self.ws_handle_task = None
@@ -298,9 +330,8 @@ class MainGame(ShowBase):
         taskMgr.remove("startLoopMusicTask")
         
         if is_victory:
-            victorySound = base.loader.loadSfx(getSoundPath("vicroy"))
             self.background_music.stop()
-            victorySound.play()
+            SOUND_BANK.play("vicroy")
             self.main_menu_music.play()
             self.gui_manager.handle_custom(StateTransitionEvents.WIN)
         else:
@@ -311,28 +342,46 @@ class MainGame(ShowBase):
 
     def __enter_queue(self):
         messenger.send(GUI_QUEUE_EVENT)
-        self.queue_task = base.taskMgr.doMethodLater(1, self.__check_queue_status, "queue_check")
-        base.taskMgr.add(join_queue, 'join_queue_task', extraArgs=[self.player_id])
+        self.is_queued = True
+        run_in_background(join_queue, [self.player_id, lambda: not self.is_queued], QUEUE_JOINED_EVENT)
+
+    def __queue_joined(self, success: bool):
+        # Queue was cancelled while joining
+        if not self.is_queued:
+            return
+        if not success:
+            # Back to the main menu, leaving the queue menu cancels the queue
+            messenger.send(GUI_RETURN_EVENT)
+            return
+        self.queue_task = base.taskMgr.doMethodLater(0, self.__check_queue_status, "queue_check", taskChain=NETWORK_TASK_CHAIN)
 
     def __cancel_queue(self):
+        self.is_queued = False
         if self.match_id is None:
             self.logger.info("Exiting queue and stopping background check.")
-            leave_queue(self.player_id)
+            run_in_background(leave_queue, [self.player_id])
         if self.queue_task is not None:
             self.queue_task.remove()
         self.queue_task = None
 
     def __check_queue_status(self, task):
-        success, status, match_id = check_queue_status(self.player_id)
-        if not success:
-            return Task.again
-        if status != QueueStatus.MATCHED.value:
-            return Task.again
-        if len(match_id) > 0:
-            self.match_id = match_id
-            self.logger.info("Game found! Joining game...")
-            self.__start_game(match_id, False)
+        """Runs on the network task chain, results are handed to the main thread via the messenger"""
+        success, status, match_id = check_queue_status(self.player_id, QUEUE_LONG_POLL_S)
+        if success and status == QueueStatus.MATCHED.value and len(match_id) > 0:
+            messenger.send(QUEUE_MATCH_FOUND_EVENT, [match_id], taskChain="default")
             return Task.done
+        # Still queued means the long poll just timed out, ask again right away
+        task.delayTime = 0 if success and status == QueueStatus.IN_QUEUE.value else QUEUE_RETRY_DELAY_S
+        return Task.again
+
+    def __match_found(self, match_id: str):
+        # Queue was cancelled while the request was in flight
+        if self.queue_task is None:
+            return
+        self.is_queued = False
+        self.match_id = match_id
+        self.logger.info("Game found! Joining game...")
+        self.__start_game(match_id, False)
 
     def startLoopMusic(self,task):
         self.background_music = base.loader.loadMusic(getMusicPath("music_mid"))
@@ -393,10 +442,10 @@ class MainGame(ShowBase):
                   
     def __process_ws_message(self, msg):
         if self.anti_player is not None:
-            # Player info package
-            if (player_info := parse_player_info(msg)) is not None:
-                self.player.update_state(player_info)
-                self.anti_player.set_state(player_info)
+            # Player info package, already decoded and coalesced per frame by MatchWS
+            if isinstance(msg, PlayerInfo):
+                self.player.update_state(msg)
+                self.anti_player.set_state(msg)
                 return
             if (game_status := parse_game_status(msg)) is not None:
                 match game_status.message:
@@ -432,11 +481,22 @@ class MainGame(ShowBase):
 
     def __main_loop_online(self, dt):
         self.time_since_last_package += dt
-        if self.time_since_last_package > TIME_BETWEEN_PACKAGES_IN_S:
+        interval = self.send_rate.update(
+            dt,
+            distance=(self.player.getPos(render) - self.anti_player.getPos(render)).length(),
+            is_moving=any(self.player.movement_status.values()) or self.player.vertical_velocity != 0 or self.player.is_dashing,
+            heading=self.player.body.getH(),
+            pitch=self.player.head.getP(),
+            rtt_s=self.ws.latency.rtt_s,
+            send_duration_s=self.ws.send_duration_s,
+        )
+        if self.time_since_last_package > interval:
             packet = self.player.get_current_state()
             packet.enemy_health = self.anti_player.health
             self.ws.send_game_data(packet)
             self.time_since_last_package = 0
+        if self.ws.send_ping_if_due() and (latency := self.ws.latency).rtt_s is not None:
+            messenger.send(GUI_UPDATE_LATENCY, [latency.rtt_s * 1000, latency.jitter_s * 1000, latency.loss_ratio()])
 
     def rotate_camera(self, dt):
         self.camera_angle += MAIN_MENU_CAMERA_ROTATION_SPEED * dt
@@ -452,6 +512,11 @@ class MainGame(ShowBase):
     def __main_loop(self, task):
         dt = self.clock.dt
 
+        # Network messages are only ever applied here, on the main thread
+        if self.ws is not None:
+            with FRAME_PROFILER.section("net inbox"):
+                self.ws.drain(MAX_MESSAGES_PER_FRAME)
+
         if not self.gui_manager.is_ingame():
             self.rotate_camera(dt)
             return Task.cont
@@ -461,13 +526,17 @@ class MainGame(ShowBase):
             self.__position_player_camera(update_pointer=False)
 
         if type(self.player) is not Actor:
-            self.player.update(dt)
+            with FRAME_PROFILER.section("player"):
+                self.player.update(dt)
 
         if self.is_online:
-            self.anti_player.update(dt)
-            self.__main_loop_online(dt)
+            with FRAME_PROFILER.section("anti player"):
+                self.anti_player.update(dt)
+            with FRAME_PROFILER.section("net send"):
+                self.__main_loop_online(dt)
             return Task.cont
         else:
-            self.anti_player.update(dt, self.player)
+            with FRAME_PROFILER.section("anti player"):
+                self.anti_player.update(dt, self.player)
         return Task.cont
 
@@ -1,17 +1,27 @@
+import importlib.util
 import logging
+import random
+import threading
+import time
 import traceback
 import truststore
 import ssl
 import httpx
-from typing import Tuple
+from typing import Callable, Tuple
 
-from direct.task.Task import Task
-from game.const.networking import HOST, HOST_IS_SECURE
+from direct.task.Task import Task, messenger
+from game.const.networking import HOST, HOST_IS_SECURE, JOIN_QUEUE_BASE_DELAY_S, JOIN_QUEUE_MAX_ATTEMPTS, JOIN_QUEUE_MAX_DELAY_S, NETWORK_TASK_CHAIN
 
 LOGGER = logging.getLogger(__name__)
 
 CTX = truststore.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
 
+# Seconds an idle pooled connection is kept open, a bit longer than the long poll
+KEEPALIVE_EXPIRY_S = 60
+
+__client: httpx.Client | None = None
+__client_lock = threading.Lock()
+
 def __set_logger(lvl=logging.WARN):
     requests_log = logging.getLogger("httpcore.http11")
     requests_log.setLevel(lvl)
@@ -25,26 +35,81 @@ def get_http_protocol() -> str:
         return "https"
     return "http"
 
-def join_queue(player_id: str) -> bool:
-    __set_logger()
-    url = f'{get_http_protocol()}://{HOST}/queue'
-    body = {'player_id': player_id}
-    try:
-        res = httpx.post(url, json = body, verify=CTX)
-    except Exception as e:
-        e = e.with_traceback
-        tb = traceback.format_exc()
-        LOGGER.warning(f"Could not join queue. This may indicate network problems. Either way please play against a bot in the meantime. Error {tb}")
-        return Task.done
-    if res.status_code != 201:
-        LOGGER.warning("Could not join queue. This may indicate network problems. Either way please play against a bot in the meantime")
+def get_client() -> httpx.Client:
+    """Shared keep-alive client, so requests reuse connections and TLS sessions"""
+    global __client
+    with __client_lock:
+        if __client is None:
+            __set_logger()
+            __client = httpx.Client(
+                base_url=f"{get_http_protocol()}://{HOST}",
+                verify=CTX,
+                # HTTP/2 needs the optional h2 package
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=KEEPALIVE_EXPIRY_S),
+            )
+        return __client
+
+def close_client():
+    global __client
+    with __client_lock:
+        if __client is not None:
+            __client.close()
+            __client = None
+
+def run_in_background(request_fn, args=[], done_event: str | None = None):
+    """
+    Run a blocking request on the network task chain instead of the render thread.
+    The result is delivered on the main thread as done_event with the result as only argument.
+    """
+    def request_task(task):
+        result = request_fn(*args)
+        if done_event is not None:
+            messenger.send(done_event, [result], taskChain="default")
         return Task.done
-    return Task.done
+    return base.taskMgr.add(request_task, f"network-{request_fn.__name__}", taskChain=NETWORK_TASK_CHAIN)
+
+def retry_delay(attempt: int, retry_after: str | None) -> float:
+    """Full jitter exponential backoff, never sooner than the server asked for"""
+    backoff = random.uniform(0, min(JOIN_QUEUE_MAX_DELAY_S, JOIN_QUEUE_BASE_DELAY_S * 2 ** attempt))
+    try:
+        hint = float(retry_after) if retry_after is not None else 0.0
+    except ValueError:
+        hint = 0.0
+    # The cap only limits our own backoff, a longer hint is still respected.
+    # Jitter on top spreads clients that got the same hint instead of having them return in lockstep
+    return max(hint, backoff) + random.uniform(0, JOIN_QUEUE_BASE_DELAY_S)
+
+def join_queue(player_id: str, is_cancelled: Callable[[], bool] | None = None) -> bool:
+    """Blocks while retrying a busy server, run it on the network task chain"""
+    body = {'player_id': player_id}
+    for attempt in range(JOIN_QUEUE_MAX_ATTEMPTS):
+        try:
+            res = get_client().post('/queue', json = body)
+        except Exception:
+            tb = traceback.format_exc()
+            LOGGER.warning(f"Could not join queue. This may indicate network problems. Either way please play against a bot in the meantime. Error {tb}")
+            return False
+        if res.status_code == 201:
+            return True
+        if res.status_code not in [429, 503]:
+            break
+        delay = retry_delay(attempt, res.headers.get("Retry-After"))
+        LOGGER.info(f"Server is busy, retrying to join the queue in {delay:.1f}s")
+        time.sleep(delay)
+        if is_cancelled is not None and is_cancelled():
+            return False
+    LOGGER.warning("Could not join queue. This may indicate network problems. Either way please play against a bot in the meantime")
+    return False
 
-def check_queue_status(player_id: str) -> Tuple[ bool, str, str]:
-    __set_logger()
+def check_queue_status(player_id: str, wait_s: float = 0) -> Tuple[ bool, str, str]:
+    """With wait_s > 0 the server holds the request until the status changes (long poll)"""
     try:
-        res = httpx.get(f"{get_http_protocol()}://{HOST}/queue/{player_id}", verify=CTX)
+        res = get_client().get(
+            f"/queue/{player_id}",
+            params={"wait": wait_s},
+            timeout=wait_s + 5,
+        )
     except Exception as e:
         LOGGER.warning(f"Could not join queue. This may indicate network problems. Either way please play against a bot in the meantime. Error {e}")
         return (False, "", "")
@@ -55,11 +120,8 @@ def check_queue_status(player_id: str) -> Tuple[ bool, str, str]:
     return (True, res.json()["status"], id)
 
 def leave_queue(player_id: str) -> bool:
-    __set_logger()
-
-    url = f'{get_http_protocol()}://{HOST}/queue/{player_id}'
     try:
-        res = httpx.delete(url, verify=CTX)
+        res = get_client().delete(f'/queue/{player_id}')
     except Exception as e:
         LOGGER.warning(f"Could not leave queue. This may indicate network problems. Either way please play against a bot in the meantime. Error {e}")
         return False
@@ -67,5 +129,3 @@ def leave_queue(player_id: str) -> bool:
         LOGGER.warning("Could not leave queue. This may indicate network problems. Either way please play against a bot in the meantime")
         return False
     return True
-
-
@@ -0,0 +1,47 @@
+from typing import Any, List
+
+
+class SPSCRingBuffer:
+    """
+    Bounded single producer, single consumer queue without locks.
+    Only the producer writes tail and only the consumer writes head. Reading and storing a
+    plain attribute is atomic in CPython, so each side always sees a consistent index of the other.
+    """
+    def __init__(self, capacity: int) -> None:
+        # One slot always stays empty to tell a full buffer from an empty one
+        self.size = capacity + 1
+        self.slots: List[Any] = [None] * self.size
+        self.head = 0
+        self.tail = 0
+
+    def __len__(self) -> int:
+        return (self.tail - self.head) % self.size
+
+    def is_full(self) -> bool:
+        return (self.tail + 1) % self.size == self.head
+
+    def push(self, item: Any) -> bool:
+        """Producer side, returns False if the buffer is full"""
+        next_tail = (self.tail + 1) % self.size
+        if next_tail == self.head:
+            return False
+        self.slots[self.tail] = item
+        # Publish only after the slot is written
+        self.tail = next_tail
+        return True
+
+    def pop(self) -> Any | None:
+        """Consumer side, returns None if the buffer is empty"""
+        if self.head == self.tail:
+            return None
+        item = self.slots[self.head]
+        self.slots[self.head] = None
+        self.head = (self.head + 1) % self.size
+        return item
+
+    def drain(self, limit: int) -> List[Any]:
+        """Consumer side, pops up to limit items in order"""
+        items = []
+        while len(items) < limit and (item := self.pop()) is not None:
+            items.append(item)
+        return items
@@ -0,0 +1,77 @@
+import logging
+from collections import deque
+from typing import Deque
+
+from game.const.networking import (
+    COMBAT_DISTANCE,
+    FAR_DISTANCE,
+    IDLE_AFTER_S,
+    MAX_SEND_BACKOFF_FACTOR,
+    RTT_BACKOFF_THRESHOLD_S,
+    SEND_DURATION_BACKOFF_THRESHOLD_S,
+    SEND_INTERVAL_COMBAT_S,
+    SEND_INTERVAL_DEFAULT_S,
+    SEND_INTERVAL_FAR_S,
+    SEND_INTERVAL_IDLE_S,
+)
+
+# Rotation changes below this (degrees) do not count as activity
+ROTATION_EPSILON = 0.5
+
+class RateCounter:
+    """Events per second over a sliding window, plus a running total"""
+    def __init__(self, window_s: float = 1.0) -> None:
+        self.window_s = window_s
+        self.events: Deque[float] = deque()
+        self.total = 0
+
+    def record(self, now: float):
+        self.events.append(now)
+        self.total += 1
+
+    def rate(self, now: float) -> float:
+        while self.events and now - self.events[0] > self.window_s:
+            self.events.popleft()
+        return len(self.events) / self.window_s
+
+class SendRateController:
+    """
+    Picks the interval between state packets: fast in close combat, slow when idle or far away,
+    and stretched while the connection is congested. Priority packets (actions) are not affected.
+    """
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.idle_time = 0.0
+        self.last_rotation = (0.0, 0.0)
+        self.mode = "default"
+        self.interval_s = SEND_INTERVAL_DEFAULT_S
+
+    def update(self, dt: float, distance: float, is_moving: bool, heading: float, pitch: float, rtt_s: float | None, send_duration_s: float) -> float:
+        """Interval to use for this frame"""
+        is_turning = abs(heading - self.last_rotation[0]) > ROTATION_EPSILON or abs(pitch - self.last_rotation[1]) > ROTATION_EPSILON
+        self.last_rotation = (heading, pitch)
+        self.idle_time = 0.0 if is_moving or is_turning else self.idle_time + dt
+
+        # Combat wins over idle, standing still while blocking still needs full fidelity
+        if distance < COMBAT_DISTANCE:
+            mode, interval = "combat", SEND_INTERVAL_COMBAT_S
+        elif self.idle_time >= IDLE_AFTER_S:
+            mode, interval = "idle", SEND_INTERVAL_IDLE_S
+        elif distance > FAR_DISTANCE:
+            mode, interval = "far", SEND_INTERVAL_FAR_S
+        else:
+            mode, interval = "default", SEND_INTERVAL_DEFAULT_S
+
+        # Back off while round trips or blocking sends show the connection cannot keep up
+        backoff = 1.0
+        if rtt_s is not None and rtt_s > RTT_BACKOFF_THRESHOLD_S:
+            backoff = max(backoff, rtt_s / RTT_BACKOFF_THRESHOLD_S)
+        if send_duration_s > SEND_DURATION_BACKOFF_THRESHOLD_S:
+            backoff = max(backoff, send_duration_s / SEND_DURATION_BACKOFF_THRESHOLD_S)
+        interval *= min(backoff, MAX_SEND_BACKOFF_FACTOR)
+
+        if mode != self.mode:
+            self.logger.debug(f"Send rate {self.mode} -> {mode} ({1 / interval:.1f} Hz)")
+            self.mode = mode
+        self.interval_s = interval
+        return interval
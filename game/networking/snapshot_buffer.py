@@ -0,0 +1,95 @@
+import math
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque
+
+# Local estimate of the sender clock is reset instead of smoothed when it is off by more than this
+CLOCK_RESYNC_THRESHOLD_S = 0.5
+CLOCK_SMOOTHING = 0.1
+
+@dataclass(slots=True)
+class Snapshot:
+    time: float
+    x: float
+    y: float
+    heading: float
+    pitch: float
+    # Body relative movement as sent by the remote player
+    move_x: float = 0.0
+    move_y: float = 0.0
+
+def lerp(a: float, b: float, t: float) -> float:
+    return a + (b - a) * t
+
+def lerp_angle(a: float, b: float, t: float) -> float:
+    """Interpolate degrees along the shorter way around"""
+    return a + ((b - a + 180.0) % 360.0 - 180.0) * t
+
+class SnapshotBuffer:
+    """
+    Timestamped remote transforms, sampled a fixed delay in the past so there usually is a snapshot
+    on either side of the sample time. Past the newest snapshot the last movement is continued for a bounded time.
+    """
+    def __init__(self, capacity: int, delay_s: float, max_extrapolation_s: float) -> None:
+        self.snapshots: Deque[Snapshot] = deque(maxlen=capacity)
+        self.delay_s = delay_s
+        self.max_extrapolation_s = max_extrapolation_s
+        # Sender match time minus local match time
+        self.clock_offset: float | None = None
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+    def clear(self):
+        self.snapshots.clear()
+        self.clock_offset = None
+
+    def push(self, snapshot: Snapshot, local_time: float):
+        if self.snapshots and snapshot.time <= self.snapshots[-1].time:
+            # Stale or duplicate, a newer state is already known
+            return
+        self.snapshots.append(snapshot)
+        offset = snapshot.time - local_time
+        if self.clock_offset is None or abs(offset - self.clock_offset) > CLOCK_RESYNC_THRESHOLD_S:
+            self.clock_offset = offset
+        else:
+            self.clock_offset += (offset - self.clock_offset) * CLOCK_SMOOTHING
+
+    def sample(self, local_time: float) -> Snapshot | None:
+        if not self.snapshots:
+            return None
+        render_time = local_time + self.clock_offset - self.delay_s
+        # Keep the newest snapshot at or before the render time as the start of the interval
+        while len(self.snapshots) >= 2 and self.snapshots[1].time <= render_time:
+            self.snapshots.popleft()
+
+        start = self.snapshots[0]
+        if render_time <= start.time:
+            return start
+        if len(self.snapshots) >= 2:
+            end = self.snapshots[1]
+            t = (render_time - start.time) / (end.time - start.time)
+            return Snapshot(
+                render_time,
+                lerp(start.x, end.x, t),
+                lerp(start.y, end.y, t),
+                lerp_angle(start.heading, end.heading, t),
+                lerp(start.pitch, end.pitch, t),
+                end.move_x,
+                end.move_y,
+            )
+
+        # Ran out of snapshots, continue the last known movement for a bit
+        ahead = min(render_time - start.time, self.max_extrapolation_s)
+        heading = math.radians(start.heading)
+        world_x = start.move_x * math.cos(heading) - start.move_y * math.sin(heading)
+        world_y = start.move_x * math.sin(heading) + start.move_y * math.cos(heading)
+        return Snapshot(
+            start.time + ahead,
+            start.x + world_x * ahead,
+            start.y + world_y * ahead,
+            start.heading,
+            start.pitch,
+            start.move_x,
+            start.move_y,
+        )
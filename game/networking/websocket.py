@@ -1,9 +1,18 @@
+import json
 import logging
-from time import time
-from game.const.networking import HOST, HOST_IS_SECURE, TIME_BETWEEN_PACKAGES_IN_S
+import threading
+from dataclasses import asdict
+from time import perf_counter, sleep, time
+from game.const.networking import DELTA_KEYFRAME_INTERVAL_S, HOST, HOST_IS_SECURE, PACKET_RATE_LOG_INTERVAL_S, PING_INTERVAL_S, PING_TIMEOUT_S, RECEIVE_BUFFER_SIZE, RECEIVE_BUFFER_WAIT_S, TIME_BETWEEN_PACKAGES_IN_S, USE_DELTA_COMPRESSION
+from game.networking.ring_buffer import SPSCRingBuffer
+from game.networking.send_rate import RateCounter
 from ws4py.client.threadedclient import WebSocketClient
 
-from shared.types.player_info import PlayerInfo
+from shared.types.player_delta import DeltaDecoder, DeltaEncoder, is_delta_packet
+from shared.types.player_info import PlayerInfo, coalesce_player_info
+from shared.types.status_message import GameStatus, StatusMessages
+from shared.utils.latency import LatencyTracker
+from shared.utils.validation import enum_friendly_factory, parse_game_status, parse_player_info
 
 def get_ws_protocol() -> str:
     if HOST_IS_SECURE:
@@ -18,9 +27,23 @@ class MatchWS(WebSocketClient):
         super().__init__(self.url, protocols, extensions, heartbeat_freq, ssl_options, headers, exclude_headers)
         self.recv_cb = recv_callback
         self.connected = False
+        # Set up before connecting, messages may arrive on the client thread right away
+        # Filled by the ws4py reader thread, drained on the main thread once per frame
+        self.inbox = SPSCRingBuffer(RECEIVE_BUFFER_SIZE)
+        # Pings are answered from the reader thread, all sends go through this lock
+        self.send_lock = threading.Lock()
+        self.latency = LatencyTracker(PING_TIMEOUT_S)
+        self.last_ping = 0.0
+        self.delta_encoder = DeltaEncoder(DELTA_KEYFRAME_INTERVAL_S)
+        self.delta_decoder = DeltaDecoder()
         self.connect()
         self.last_packet: PlayerInfo = PlayerInfo()
         self.last_packet_time = time()
+        self.sent_packets = RateCounter()
+        self.sent_bytes = 0
+        self.last_rate_log = time()
+        # Smoothed time a send blocks, grows when the socket buffer backs up
+        self.send_duration_s = 0.0
 
     def opened(self):
         self.logger.info("Match connection established...")
@@ -35,17 +58,104 @@ class MatchWS(WebSocketClient):
             self.logger.error("Tried to send websocket data but connection was not yet established.")
             return
 
+        if USE_DELTA_COMPRESSION:
+            # Unchanged state produces no packet at all
+            if (delta := self.delta_encoder.encode(data, time())) is not None:
+                self.__send_binary(delta)
+            return
+
         # Don't send duplicate packages
         if self.last_packet.__hash__() == data.__hash__() and time() - self.last_packet_time > (TIME_BETWEEN_PACKAGES_IN_S * 4):
             return
 
-        self.send(data.to_bytes(), binary=True)
+        self.__send_binary(data.to_bytes())
         self.last_packet = data
         self.last_packet_time = time()
 
+    def __send_binary(self, payload: bytes):
+        start = perf_counter()
+        with self.send_lock:
+            self.send(payload, binary=True)
+        self.send_duration_s += ((perf_counter() - start) - self.send_duration_s) * 0.1
+        now = time()
+        self.sent_packets.record(now)
+        self.sent_bytes += len(payload)
+        if now - self.last_rate_log > PACKET_RATE_LOG_INTERVAL_S:
+            self.last_rate_log = now
+            self.logger.debug(f"Sending {self.packets_per_second():.1f} packets/s ({self.sent_packets.total} packets, {self.sent_bytes} bytes total)")
+
+    def __send_control_message(self, message: GameStatus):
+        with self.send_lock:
+            self.send(json.dumps(asdict(message, dict_factory=enum_friendly_factory)))
+
+    def send_ping_if_due(self) -> bool:
+        """Ping the server every PING_INTERVAL_S, returns True if a ping was sent"""
+        now = perf_counter()
+        if not self.connected or now - self.last_ping < PING_INTERVAL_S:
+            return False
+        self.last_ping = now
+        self.__send_control_message(GameStatus(StatusMessages.PING, str(self.latency.next_ping(now))))
+        return True
+
+    def packets_per_second(self) -> float:
+        return self.sent_packets.rate(time())
+
+    def decode_player_info(self, raw) -> PlayerInfo | None:
+        """Full or delta packet of the opponent, None for anything else"""
+        if not isinstance(raw, (bytes, bytearray)):
+            return None
+        if not is_delta_packet(raw):
+            return parse_player_info(raw)
+        try:
+            return self.delta_decoder.decode(raw)
+        except Exception as e:
+            self.logger.warning(f"Dropped malformed delta packet: {e}")
+            return None
+
     def received_message(self, message):
-        if message.is_text:
-            recvStr = message.data.decode("utf-8")
-            self.recv_cb(recvStr)
-        else:
-            self.recv_cb(message.data)
+        # Runs on the ws4py reader thread, must not touch game state
+        arrival = perf_counter()
+        payload = message.data.decode("utf-8") if message.is_text else message.data
+        if message.is_text and (status := parse_game_status(payload)) is not None and status.message == StatusMessages.PING.value:
+            # Answered right here so the server side round trip does not include our frame time
+            self.__send_control_message(GameStatus(StatusMessages.PONG, status.detail))
+            return
+        if self.inbox.push((arrival, payload)):
+            return
+        self.logger.warning("Receive buffer full, waiting for the game to catch up")
+        # Blocking the reader thread pushes back on the socket instead of dropping messages
+        while not self.inbox.push((arrival, payload)):
+            if self.terminated:
+                return
+            sleep(RECEIVE_BUFFER_WAIT_S)
+
+    def __parse_pong(self, payload) -> GameStatus | None:
+        if not isinstance(payload, str) or (status := parse_game_status(payload)) is None:
+            return None
+        return status if status.message == StatusMessages.PONG.value else None
+
+    def drain(self, limit: int):
+        """
+        Hand received messages to the callback, call from the main thread.
+        Consecutive player info packets are decoded and coalesced into a single update,
+        so a burst after a network hiccup costs one state update instead of one per packet.
+        """
+        pending: PlayerInfo | None = None
+        for arrival, payload in self.inbox.drain(limit):
+            if (player_info := self.decode_player_info(payload)) is not None:
+                pending = player_info if pending is None else coalesce_player_info(pending, player_info)
+                continue
+            if (status := self.__parse_pong(payload)) is not None:
+                # Measured against the arrival on the reader thread, not against this frame
+                try:
+                    self.latency.record_pong(int(status.detail), arrival)
+                except ValueError:
+                    self.logger.warning(f"Pong with invalid sequence {status.detail}")
+                continue
+            # Control messages stay ordered relative to the game state around them
+            if pending is not None:
+                self.recv_cb(pending)
+                pending = None
+            self.recv_cb(payload)
+        if pending is not None:
+            self.recv_cb(pending)
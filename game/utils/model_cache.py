@@ -0,0 +1,37 @@
+import logging
+from typing import Dict, Tuple
+
+from direct.actor.Actor import Actor
+
+from game.helpers.helpers import getModelPath
+
+LOGGER = logging.getLogger(__name__)
+
+# (model name, animations) -> template actor, templates are never part of the scene graph
+__templates: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Actor] = dict()
+
+def __key(name: str, anims: Dict[str, str] | None):
+    return (name, tuple(sorted((anims or {}).items())))
+
+def preload_actor(name: str, anims: Dict[str, str] | None = None) -> Actor:
+    """
+    Load a model and its animations (anim name -> model name) once for the whole run.
+    Returns the cached template, use get_actor for anything that goes into the scene.
+    """
+    key = __key(name, anims)
+    if (template := __templates.get(key)) is None:
+        template = Actor(getModelPath(name), {anim: getModelPath(anim_model) for anim, anim_model in (anims or {}).items()})
+        # Bind now, copies share the bundles instead of loading them on first play
+        template.bindAllAnims()
+        __templates[key] = template
+        LOGGER.debug(f"Cached {name} with {len(key[1])} animations")
+    return template
+
+def get_actor(name: str, anims: Dict[str, str] | None = None) -> Actor:
+    """New actor with its own joints, copied from the cached template instead of loaded from disk"""
+    return Actor(other=preload_actor(name, anims))
+
+def evict(name: str | None = None):
+    """Drop the templates of one model or, without a name, all of them"""
+    for key in [key for key in __templates if name is None or key[0] == name]:
+        __templates.pop(key).cleanup()
@@ -0,0 +1,98 @@
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, List, Tuple
+
+from direct.particles import ParticleEffect as ParticleEffectModule
+from direct.particles.ParticleEffect import ParticleEffect
+from direct.showbase.ShowBaseGlobal import NodePath
+from panda3d.core import VirtualFileSystem
+
+from game.helpers.helpers import getParticlePath
+
+# Particles that may be alive across all pooled effects, counted by the pool size of each running system
+MAX_LIVE_PARTICLES = 2000
+
+class ParticlePool():
+    """
+    Particle effects that are created once and then recycled.
+    Every .ptf is read and compiled once, each type gets a fixed number of instances up front.
+    When a type has no free instance or the particle budget is used up its oldest running effect is restarted instead.
+    """
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(__name__)
+        # effect name -> compiled .ptf
+        self.templates = dict()
+        self.free: Dict[str, List[ParticleEffect]] = dict()
+        # effect name -> (release time, effect), oldest first
+        self.active: Dict[str, Deque[Tuple[float, ParticleEffect]]] = dict()
+        self.capacity: Dict[ParticleEffect, int] = dict()
+        self.live_particles = 0
+        self.task = None
+
+    def __get_template(self, name: str):
+        if name not in self.templates:
+            data = VirtualFileSystem.getGlobalPtr().readFile(getParticlePath(name), True).replace(b"\r", b"")
+            self.templates[name] = compile(data, getParticlePath(name), "exec")
+        return self.templates[name]
+
+    def __create(self, name: str) -> ParticleEffect:
+        effect = ParticleEffect()
+        # Same as ParticleEffect.loadConfig, .ptf files expect its module globals and self.
+        # A copy, so names a .ptf binds or imports do not end up in the ParticleEffect module
+        exec(self.__get_template(name), dict(vars(ParticleEffectModule)), {"self": effect})
+        self.capacity[effect] = sum(particles.getPoolSize() for particles in effect.getParticlesList())
+        return effect
+
+    def preload(self, name: str, count: int, configure: Callable[[ParticleEffect], None] | None = None):
+        """Create count instances of an effect, configure runs once per instance"""
+        free = self.free.setdefault(name, [])
+        self.active.setdefault(name, deque())
+        for _ in range(count):
+            effect = self.__create(name)
+            if configure is not None:
+                configure(effect)
+            free.append(effect)
+        if self.task is None:
+            self.task = base.taskMgr.add(self.__release_expired, "particlePoolTask")
+
+    def acquire(self, name: str, parent: NodePath, lifetime: float) -> ParticleEffect | None:
+        """
+        Start an effect under parent that is taken back after lifetime seconds.
+        Returns None if the effect was not preloaded or nothing can be recycled within the budget.
+        """
+        if name not in self.free:
+            self.logger.warning(f"Particle effect {name} was not preloaded")
+            return None
+        free, active = self.free[name], self.active[name]
+        if len(free) > 0 and self.live_particles + self.capacity[free[-1]] <= MAX_LIVE_PARTICLES:
+            effect = free.pop()
+            self.live_particles += self.capacity[effect]
+        elif len(active) > 0:
+            # Restart the oldest one, its particles are already counted
+            effect = active.popleft()[1]
+        else:
+            return None
+        effect.disable()
+        effect.clearToInitial()
+        effect.start(parent=parent, renderParent=parent)
+        active.append((base.clock.getFrameTime() + lifetime, effect))
+        return effect
+
+    def __release(self, name: str, effect: ParticleEffect):
+        effect.disable()
+        self.live_particles -= self.capacity[effect]
+        self.free[name].append(effect)
+
+    def __release_expired(self, task):
+        now = base.clock.getFrameTime()
+        for name, active in self.active.items():
+            while len(active) > 0 and active[0][0] <= now:
+                self.__release(name, active.popleft()[1])
+        return task.cont
+
+    def release_all(self):
+        for name, active in self.active.items():
+            while len(active) > 0:
+                self.__release(name, active.popleft()[1])
+
+PARTICLE_POOL = ParticlePool()
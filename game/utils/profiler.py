@@ -0,0 +1,206 @@
+import csv
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+from direct.gui.OnscreenText import OnscreenText
+from panda3d.core import PStatClient, PStatCollector, TextNode
+
+# "1" enables the profiler and its overlay at startup, F3 toggles it at runtime
+PROFILE_ENV_VAR = "PROFILE_FRAMES"
+# Per frame section times are appended to this csv file (frame, section, ms)
+PROFILE_CSV_ENV_VAR = "PROFILE_CSV"
+# "1" also reports the sections to a running PStats server
+PROFILE_PSTATS_ENV_VAR = "PROFILE_PSTATS"
+
+# Frames kept per section for the percentiles
+FRAME_HISTORY = 300
+OVERLAY_UPDATE_S = 0.5
+# After igLoop (50), so the render time of the current frame is known
+FRAME_END_TASK_SORT = 55
+PSTATS_COLLECTOR_PREFIX = "App:Flow"
+
+class _NullSection():
+    """Returned while the profiler is off, entering it does nothing"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+NULL_SECTION = _NullSection()
+
+class Section():
+    """Scoped timer for one subsystem, times of all uses within a frame are added up"""
+    __slots__ = ("profiler", "name", "start", "collector")
+
+    def __init__(self, profiler, name: str) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+        self.collector: PStatCollector | None = None
+
+    def __enter__(self):
+        if self.collector is not None:
+            self.collector.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        elapsed = time.perf_counter() - self.start
+        if self.collector is not None:
+            self.collector.stop()
+        frame = self.profiler.frame_times
+        frame[self.name] = frame.get(self.name, 0.0) + elapsed
+        return False
+
+class FrameProfiler():
+    """
+    Where the frame time goes, per subsystem.
+    Python code is measured with `with FRAME_PROFILER.section(name)`, engine tasks (render, collisions, particles)
+    are read from the time Panda measured for their last run. Every frame is stored in a ring buffer per section,
+    the overlay shows p50/p99 of those.
+    """
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.enabled = False
+        self.sections: Dict[str, Section] = dict()
+        # Section name -> task names whose run time counts for it
+        self.watched_tasks: Dict[str, List[str]] = dict()
+        # Seconds spent per section in the running frame
+        self.frame_times: Dict[str, float] = dict()
+        self.history: Dict[str, Deque[float]] = dict()
+        self.frame_count = 0
+        self.frame_end_task = None
+        self.overlay: OnscreenText | None = None
+        self.last_overlay_update = 0.0
+        self.use_pstats = False
+        # Kept while the profiler is toggled off, enable continues the same trace
+        self.csv_path: str | None = None
+        self.csv_file = None
+        self.csv_writer = None
+
+    def section(self, name: str):
+        if not self.enabled:
+            return NULL_SECTION
+        if (section := self.sections.get(name)) is None:
+            section = Section(self, name)
+            if self.use_pstats:
+                section.collector = PStatCollector(f"{PSTATS_COLLECTOR_PREFIX}:{name}")
+            self.sections[name] = section
+        return section
+
+    def watch_tasks(self, name: str, task_names: List[str]):
+        """Count the run time of these tasks as section name"""
+        self.watched_tasks[name] = task_names
+
+    def configure_from_env(self):
+        if os.getenv(PROFILE_PSTATS_ENV_VAR, "0") == "1":
+            self.enable_pstats()
+        if (csv_path := os.getenv(PROFILE_CSV_ENV_VAR)) is not None:
+            self.start_csv(csv_path)
+        if os.getenv(PROFILE_ENV_VAR, "0") == "1" or self.use_pstats or self.csv_path is not None:
+            self.enable()
+
+    def enable(self, show_overlay=True):
+        if not self.enabled:
+            self.enabled = True
+            self.frame_times = dict()
+            self.frame_end_task = base.taskMgr.add(self.__end_frame, "frameProfilerTask", sort=FRAME_END_TASK_SORT)
+            if self.csv_path is not None and self.csv_file is None:
+                self.__open_csv("a")
+            self.logger.info("Frame profiler enabled")
+        if show_overlay and self.overlay is None:
+            self.overlay = OnscreenText(text="", parent=base.a2dTopLeft, pos=(0.05, -0.1), scale=0.04, align=TextNode.ALeft, fg=(1, 1, 1, 1), shadow=(0, 0, 0, 1), mayChange=True)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.frame_end_task.remove()
+        self.frame_end_task = None
+        if self.overlay is not None:
+            self.overlay.destroy()
+            self.overlay = None
+        # Flushed to disk, the path stays so enabling again appends to it
+        self.__close_csv()
+        self.logger.info("Frame profiler disabled")
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def enable_pstats(self):
+        self.use_pstats = True
+        for section in self.sections.values():
+            section.collector = PStatCollector(f"{PSTATS_COLLECTOR_PREFIX}:{section.name}")
+        # Engine tasks show up in PStats on their own
+        if not PStatClient.isConnected() and not PStatClient.connect():
+            self.logger.warning("Could not connect to a PStats server, is pstats running?")
+
+    def start_csv(self, path: str):
+        self.stop_csv()
+        self.csv_path = path
+        self.__open_csv("w")
+        self.csv_writer.writerow(["frame", "section", "ms"])
+        self.logger.info(f"Writing frame trace to {path}")
+
+    def stop_csv(self):
+        self.__close_csv()
+        self.csv_path = None
+
+    def __open_csv(self, mode: str):
+        self.csv_file = open(self.csv_path, mode, newline="")
+        self.csv_writer = csv.writer(self.csv_file)
+
+    def __close_csv(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+        self.csv_file = None
+        self.csv_writer = None
+
+    def percentiles(self, name: str) -> tuple[float, float]:
+        """p50 and p99 of a section in ms"""
+        samples = sorted(self.history.get(name, ()))
+        if len(samples) == 0:
+            return (0.0, 0.0)
+        return (samples[len(samples) // 2] * 1000, samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000)
+
+    def __end_frame(self, task):
+        frame = self.frame_times
+        self.frame_times = dict()
+        frame["frame"] = base.clock.dt
+        for name, task_names in self.watched_tasks.items():
+            elapsed = 0.0
+            for task_name in task_names:
+                for watched in base.taskMgr.getTasksNamed(task_name):
+                    elapsed += watched.getDt()
+            frame[name] = elapsed
+
+        self.frame_count += 1
+        for name, elapsed in frame.items():
+            if (samples := self.history.get(name)) is None:
+                samples = self.history[name] = deque(maxlen=FRAME_HISTORY)
+            samples.append(elapsed)
+        if self.csv_writer is not None:
+            self.csv_writer.writerows((self.frame_count, name, f"{elapsed * 1000:.3f}") for name, elapsed in frame.items())
+
+        if self.overlay is not None and task.time - self.last_overlay_update >= OVERLAY_UPDATE_S:
+            self.last_overlay_update = task.time
+            self.__update_overlay()
+        return task.cont
+
+    def __update_overlay(self):
+        lines = [f"{'':<14}{'p50':>7}{'p99':>7}"]
+        # Whole frame first, then the most expensive sections
+        names = sorted((name for name in self.history if name != "frame"), key=lambda name: self.percentiles(name)[1], reverse=True)
+        for name in ["frame"] + names:
+            p50, p99 = self.percentiles(name)
+            lines.append(f"{name:<14}{p50:>7.2f}{p99:>7.2f}")
+        self.overlay.setText("\n".join(lines))
+
+FRAME_PROFILER = FrameProfiler()
@@ -1,18 +1,77 @@
+import logging
+from typing import Dict, Iterable, List, Tuple
+
 from direct.showbase import Audio3DManager
 from direct.showbase.ShowBaseGlobal import NodePath
 
 from game.helpers.helpers import getSoundPath
 
-audio3d = None
+# Voices per sound, a sound triggered again while all of its voices play restarts the oldest one
+DEFAULT_VOICES = 2
 
-def add_3d_sound_to_node(sound_name: str, node: NodePath, delay=0.0, loops=True):
-    if node.is_empty():
-        return
-    sound_name = sound_name.removesuffix(".mp3")
-    audio3d = Audio3DManager.Audio3DManager(base.sfxManagerList[-1], base.camera)
-    sound = audio3d.loadSfx(getSoundPath(sound_name))
-    audio3d.attachSoundToObject(sound, node)
-    sound.setLoop(loops)
-    base.taskMgr.doMethodLater(delay, sound.play, f"start_sound_delayed-{sound_name}", extraArgs=[])
+class SoundBank():
+    """
+    Loaded sound effects shared by everything that plays them.
+    Every sound gets a fixed set of voices which are reused round robin, so playing never loads or decodes.
+    Positional voices are kept apart, they have to be loaded as 3D sounds.
+    """
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(__name__)
+        # (name, is 3d) -> voices and index of the voice to use next
+        self.voices: Dict[Tuple[str, bool], List] = dict()
+        self.next_voice: Dict[Tuple[str, bool], int] = dict()
+        self.audio3d: Audio3DManager.Audio3DManager | None = None
+
+    def __get_audio3d(self) -> Audio3DManager.Audio3DManager:
+        # One manager for all positional sounds, it updates every attached sound each frame
+        if self.audio3d is None:
+            self.audio3d = Audio3DManager.Audio3DManager(base.sfxManagerList[-1], base.camera)
+        return self.audio3d
+
+    def preload(self, names: Iterable[str], is_3d=False, voices=DEFAULT_VOICES):
+        for name in names:
+            self.__load(name.removesuffix(".mp3"), is_3d, voices)
+
+    def __load(self, name: str, is_3d: bool, voices: int) -> List:
+        key = (name, is_3d)
+        if key not in self.voices:
+            # The audio manager caches decoded data per file, extra voices only cost a handle
+            if is_3d:
+                self.voices[key] = [self.__get_audio3d().loadSfx(getSoundPath(name)) for _ in range(voices)]
+            else:
+                self.voices[key] = [base.loader.loadSfx(getSoundPath(name)) for _ in range(voices)]
+            self.next_voice[key] = 0
+        return self.voices[key]
 
+    def get(self, name: str, is_3d=False):
+        """Next voice of the sound, loaded on first use if it was not preloaded"""
+        name = name.removesuffix(".mp3")
+        key = (name, is_3d)
+        if key not in self.voices:
+            self.logger.debug(f"Sound {name} was not preloaded")
+        voices = self.__load(name, is_3d, DEFAULT_VOICES)
+        index = self.next_voice[key]
+        self.next_voice[key] = (index + 1) % len(voices)
+        return voices[index]
 
+    def play(self, name: str):
+        sound = self.get(name)
+        sound.setLoop(False)
+        sound.play()
+
+    def play_3d(self, name: str, node: NodePath, delay=0.0, loops=False):
+        if node.is_empty():
+            return
+        sound = self.get(name, is_3d=True)
+        # Moves the voice over from whatever node it was attached to before
+        self.__get_audio3d().attachSoundToObject(sound, node)
+        sound.setLoop(loops)
+        if delay <= 0:
+            sound.play()
+            return
+        base.taskMgr.doMethodLater(delay, sound.play, f"start_sound_delayed-{name}", extraArgs=[])
+
+SOUND_BANK = SoundBank()
+
+def add_3d_sound_to_node(sound_name: str, node: NodePath, delay=0.0, loops=True):
+    SOUND_BANK.play_3d(sound_name, node, delay=delay, loops=loops)
@@ -0,0 +1,75 @@
+"""
+Converts every .egg under assets/models to a .bam next to it and records the egg checksums in a manifest.
+getModelPath only uses a .bam while its manifest entry matches the egg, so stale bakes are never loaded.
+Run from the repository root: python3 ./scripts/bake_models.py [--force]
+Only for running from source, build_apps converts the eggs of a build itself.
+"""
+import hashlib
+import json
+import os
+import sys
+import time
+
+from panda3d.core import Filename, Loader, LoaderOptions, NodePath, PandaSystem
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets", "models")
+# Read by game.helpers.helpers.getModelPath
+MANIFEST_NAME = "bam_manifest.json"
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(models_dir: str) -> dict:
+    try:
+        with open(os.path.join(models_dir, MANIFEST_NAME)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def bake_models(models_dir: str = MODELS_DIR, force: bool = False) -> tuple[int, int]:
+    """Bake all eggs whose checksum changed, returns (baked, up to date)"""
+    manifest = load_manifest(models_dir)
+    panda_version = PandaSystem.getVersionString()
+    # Bam files are only guaranteed to load with the Panda version that wrote them
+    if manifest.get("panda_version") != panda_version:
+        manifest = {"panda_version": panda_version, "models": {}}
+    models = manifest.setdefault("models", {})
+
+    loader = Loader.getGlobalPtr()
+    # Always parse the egg itself, never a cached copy
+    options = LoaderOptions(LoaderOptions.LF_no_cache | LoaderOptions.LF_report_errors)
+    baked, up_to_date = 0, 0
+    egg_names = sorted(name for name in os.listdir(models_dir) if name.endswith(".egg"))
+    for egg_name in egg_names:
+        name = egg_name[:-len(".egg")]
+        egg_path = os.path.join(models_dir, egg_name)
+        bam_path = os.path.join(models_dir, name + ".bam")
+        checksum = file_sha256(egg_path)
+        if not force and models.get(name) == checksum and os.path.exists(bam_path):
+            up_to_date += 1
+            continue
+        start = time.perf_counter()
+        node = loader.loadSync(Filename.fromOsSpecific(egg_path), options)
+        # Written next to the egg, texture paths are stored relative to the bam file
+        if node is None or not NodePath(node).writeBamFile(Filename.fromOsSpecific(bam_path)):
+            models.pop(name, None)
+            print(f"Could not bake {egg_name}, the egg will be loaded instead")
+            continue
+        models[name] = checksum
+        baked += 1
+        print(f"Baked {egg_name} in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    # Forget eggs that were removed
+    for name in [name for name in models if name + ".egg" not in egg_names]:
+        del models[name]
+    with open(os.path.join(models_dir, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    return baked, up_to_date
+
+if __name__ == "__main__":
+    baked, up_to_date = bake_models(force="--force" in sys.argv)
+    print(f"{baked} models baked, {up_to_date} up to date")
@@ -0,0 +1,68 @@
+"""
+Bytes per match of full PlayerInfo snapshots vs. delta packets for a simulated player.
+Run from the repository root: python3 ./scripts/benchmark_delta_bandwidth.py
+"""
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.types.player_delta import DeltaDecoder, DeltaEncoder
+from shared.types.player_info import PlayerAction, PlayerInfo, Vector
+
+MATCH_LENGTH_S = 120
+SEND_INTERVAL_S = 0.05
+KEYFRAME_INTERVAL_S = 1.0
+# Server -> client frame header, the client -> server direction adds a 4 byte mask on top
+WS_FRAME_OVERHEAD = 2
+
+def simulate(seed: int = 39):
+    """Yields (time, packet) like MainGame does: a snapshot every interval plus priority packets for actions"""
+    rng = random.Random(seed)
+    x, y, heading, pitch = 0.0, -5.0, 0.0, 0.0
+    movement = (0.0, 0.0)
+    health = 10
+    now = 0.0
+    while now < MATCH_LENGTH_S:
+        now += SEND_INTERVAL_S
+        # Change input every ~0.5s, stand still about a third of the time
+        if rng.random() < 0.1:
+            direction = rng.choice([None, None, 0, 45, 90, 135, 180, 225, 270, 315])
+            movement = (0.0, 0.0) if direction is None else (3 * math.cos(math.radians(direction)), 3 * math.sin(math.radians(direction)))
+        x += movement[0] * SEND_INTERVAL_S
+        y += movement[1] * SEND_INTERVAL_S
+        # Mouse look while fighting
+        if rng.random() < 0.4:
+            heading += rng.uniform(-8, 8)
+            pitch = max(-85, min(85, pitch + rng.uniform(-3, 3)))
+        if rng.random() < 0.05:
+            action = rng.choice([PlayerAction.ATTACK_1, PlayerAction.BLOCK, PlayerAction.SWEEP_1, PlayerAction.JUMP])
+            yield now, PlayerInfo(actions=[action], action_offsets=[now], health=health)
+        if rng.random() < 0.005:
+            health = max(1, health - 1)
+        yield now, PlayerInfo(
+            health=health,
+            position=Vector(x, y, 0.0, 1),
+            lookRotation=pitch,
+            bodyRotation=heading,
+            movement=Vector(movement[0], movement[1], 0.0, math.hypot(*movement)),
+            match_time=now,
+        )
+
+if __name__ == "__main__":
+    encoder = DeltaEncoder(KEYFRAME_INTERVAL_S)
+    decoder = DeltaDecoder()
+    full_bytes = full_packets = delta_bytes = delta_packets = 0
+    for now, packet in simulate():
+        full = packet.to_bytes()
+        full_bytes += len(full) + WS_FRAME_OVERHEAD
+        full_packets += 1
+        if (delta := encoder.encode(packet, now)) is not None:
+            decoder.decode(delta)
+            delta_bytes += len(delta) + WS_FRAME_OVERHEAD
+            delta_packets += 1
+    print(f"full snapshots  {full_packets:6} packets {full_bytes / MATCH_LENGTH_S:8.0f} B/s per player")
+    print(f"delta packets   {delta_packets:6} packets {delta_bytes / MATCH_LENGTH_S:8.0f} B/s per player")
+    print(f"reduction x{full_bytes / delta_bytes:.2f}")
@@ -0,0 +1,109 @@
+"""
+Per packet decode cost of PlayerInfo, current codec vs. the previous per-call struct implementation.
+Encoding is at parity with the old code, it is measured to catch regressions.
+Run from the repository root: python3 ./scripts/benchmark_player_info.py
+"""
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from shared.types.player_info import PlayerAction, PlayerInfo, Vector
+
+ITERATIONS = 100_000
+
+def legacy_to_bytes(info: PlayerInfo) -> bytes:
+    parts = []
+    parts.append(struct.pack("B i i B f B f B",
+        1 if info.position else 0,
+        info.health,
+        info.enemy_health,
+        1 if info.lookRotation is not None else 0,
+        info.lookRotation if info.lookRotation is not None else 0.0,
+        1 if info.bodyRotation is not None else 0,
+        info.bodyRotation if info.bodyRotation is not None else 0.0,
+        1 if info.movement else 0
+    ))
+    if info.position:
+        parts.append(struct.pack("ffff", info.position.x, info.position.y, info.position.z, info.position.length))
+    if info.movement:
+        parts.append(struct.pack("ffff", info.movement.x, info.movement.y, info.movement.z, info.movement.length))
+    parts.append(struct.pack("I", len(info.actions)))
+    for action in info.actions:
+        parts.append(struct.pack("B", action.value))
+    parts.append(struct.pack("I", len(info.action_offsets)))
+    if info.action_offsets:
+        parts.append(struct.pack(f"{len(info.action_offsets)}f", *info.action_offsets))
+    return b"".join(parts)
+
+def legacy_from_bytes(data: bytes) -> PlayerInfo:
+    offset = 0
+    fmt = "B i i B f B f B"
+    fixed_size = struct.calcsize(fmt)
+    values = struct.unpack(fmt, data[:fixed_size])
+    offset += fixed_size
+
+    pos_flag, health, enemy_health, look_flag, look_rotation, body_flag, body_rotation, move_flag = values
+    pos = Vector(*struct.unpack("ffff", data[offset:offset+16])) if pos_flag else None
+    offset += 16 if pos_flag else 0
+
+    move = Vector(*struct.unpack("ffff", data[offset:offset+16])) if move_flag else None
+    offset += 16 if move_flag else 0
+
+    actions_len = struct.unpack("I", data[offset:offset+4])[0]
+    offset += 4
+    actions = [
+        PlayerAction(struct.unpack("B", data[offset+i:offset+i+1])[0]) 
+        for i in range(actions_len)
+    ]
+    offset += actions_len
+
+    offsets_len = struct.unpack("I", data[offset:offset+4])[0]
+    offset += 4
+    action_offsets = list(struct.unpack(f"{offsets_len}f", data[offset:offset + 4 * offsets_len]))
+
+    return PlayerInfo(
+        position=pos,
+        health=health,
+        enemy_health=enemy_health,
+        lookRotation=look_rotation if look_flag else None,
+        bodyRotation=body_rotation if body_flag else None,
+        movement=move,
+        actions=actions,
+        action_offsets=action_offsets
+    )
+
+def measure(label: str, fn):
+    per_call_us = min(timeit.repeat(fn, number=ITERATIONS, repeat=7)) / ITERATIONS * 1_000_000
+    print(f"{label:<32} {per_call_us:8.3f}us")
+    return per_call_us
+
+if __name__ == "__main__":
+    packets = {
+        "movement snapshot": PlayerInfo(
+            position=Vector(1.0, 2.0, 0.5, 1.0),
+            health=10,
+            enemy_health=9,
+            lookRotation=12.5,
+            bodyRotation=180.0,
+            movement=Vector(0.0, 3.0, 0.0, 3.0),
+        ),
+        "priority (1 action)": PlayerInfo(actions=[PlayerAction.ATTACK_1], action_offsets=[12.0], health=10),
+        "merged (8 actions)": PlayerInfo(
+            position=Vector(1.0, 2.0, 0.5, 1.0),
+            movement=Vector(0.0, 3.0, 0.0, 3.0),
+            actions=[PlayerAction.SWEEP_1, PlayerAction.BLOCK] * 4,
+            action_offsets=[float(i) for i in range(8)],
+        ),
+    }
+    for name, packet in packets.items():
+        data = packet.to_bytes()
+        assert data == legacy_to_bytes(packet), "Codec is no longer wire compatible"
+        print(f"{name} ({len(data)} bytes)")
+        old_encode = measure("  encode before", lambda: legacy_to_bytes(packet))
+        new_encode = measure("  encode after", packet.to_bytes)
+        old_decode = measure("  decode before", lambda: legacy_from_bytes(data))
+        new_decode = measure("  decode after", lambda: PlayerInfo.from_bytes(data))
+        print(f"  speedup encode x{old_encode / new_encode:.2f} decode x{old_decode / new_decode:.2f}")
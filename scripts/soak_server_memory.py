@@ -0,0 +1,141 @@
+"""
+Runs complete matches in process (queue, match, players, relay, cleanup) against fake websockets
+and reports the resident set size, which should stay flat once warmed up.
+Every batch also leaves lobbies behind that are never filled, those have to be reaped by the lobby timeout.
+Run from the repository root: python3 ./scripts/soak_server_memory.py [matches]
+"""
+import asyncio
+import gc
+import logging
+import os
+import resource
+import sys
+import time
+import uuid
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi.websockets import WebSocketState
+
+from server.matchmaking import MatchMaker
+from server.scheduler import TickScheduler
+from shared.types.player_info import PlayerAction, PlayerInfo, Vector
+
+MATCHES = 100_000
+# Matches played at the same time
+BATCH_SIZE = 200
+PACKETS_PER_PLAYER = 20
+# Lobbies per batch nobody connects to, and lobbies the first player joins and leaves again
+ABANDONED_PER_BATCH = 10
+LEFT_PER_BATCH = 10
+# Short so abandoned lobbies expire at the end of their batch, the played matches start long before
+LOBBY_TIMEOUT_S = 0.05
+REPORT_EVERY = 10_000
+# Growth after warm up that counts as a leak
+MAX_RSS_GROWTH_MB = 10
+WARMUP_MATCHES = 10_000
+
+def rss_mb() -> float:
+    """Current RSS on Linux, peak RSS elsewhere"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # kB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+class FakeWebSocket():
+    """Plays back a fixed list of packets once the match started, then disconnects"""
+    def __init__(self, packets, started: asyncio.Event) -> None:
+        self.incoming = deque(packets)
+        self.started = started
+        self.client_state = WebSocketState.CONNECTED
+
+    async def receive(self):
+        await self.started.wait()
+        await asyncio.sleep(0)
+        if len(self.incoming) == 0:
+            self.client_state = WebSocketState.DISCONNECTED
+            return {"type": "websocket.disconnect", "code": 1000}
+        return {"type": "websocket.receive", "bytes": self.incoming.popleft()}
+
+    async def send_bytes(self, data):
+        pass
+
+    async def send_text(self, data):
+        pass
+
+    async def close(self):
+        self.client_state = WebSocketState.DISCONNECTED
+
+def packets(loser: bool):
+    result = []
+    for i in range(PACKETS_PER_PLAYER):
+        actions = [PlayerAction.ATTACK_1] if i % 5 == 0 else []
+        result.append(PlayerInfo(
+            position=Vector(i * 0.1, 0, 0, 1), movement=Vector(0, 1, 0, 1), lookRotation=0.0, bodyRotation=float(i),
+            health=10, actions=actions, action_offsets=[0.0] * len(actions),
+        ).to_bytes())
+    if loser:
+        result.append(PlayerInfo(health=0).to_bytes())
+    return result
+
+async def play_batch(match_maker: MatchMaker, scheduler: TickScheduler, winner_packets, loser_packets):
+    started = asyncio.Event()
+    accepts = []
+    for _ in range(BATCH_SIZE):
+        player_1, player_2 = str(uuid.uuid4()), str(uuid.uuid4())
+        match_maker.add_player(player_1)
+        match_maker.add_player(player_2)
+        match = match_maker.get_match(match_maker.player_id_match_lookup[player_1])
+        accepts.append(match.accept_player(player_1, "A", FakeWebSocket(winner_packets, started)))
+        accepts.append(match.accept_player(player_2, "B", FakeWebSocket(loser_packets, started)))
+    for i in range(ABANDONED_PER_BATCH + LEFT_PER_BATCH):
+        player_1, player_2 = str(uuid.uuid4()), str(uuid.uuid4())
+        match_maker.add_player(player_1)
+        match_maker.add_player(player_2)
+        if i < LEFT_PER_BATCH:
+            match = match_maker.get_match(match_maker.player_id_match_lookup[player_1])
+            accepts.append(match.accept_player(player_1, "A", FakeWebSocket([], started)))
+    tasks = [asyncio.ensure_future(accept) for accept in accepts]
+    await asyncio.sleep(0)
+    # Starts every match of the batch
+    await scheduler.tick(time.monotonic())
+    started.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # Notices the finished matches, then the reaper forgets them and the lobbies that timed out
+    await scheduler.tick(time.monotonic())
+    await asyncio.sleep(LOBBY_TIMEOUT_S)
+    match_maker.cleanup()
+    # Lets the terminations of the abandoned lobbies run
+    await asyncio.sleep(0)
+
+async def main(total_matches: int):
+    logging.disable(logging.INFO)
+    scheduler = TickScheduler()
+    # No room to spare, a lobby that is not reaped makes the next batch fail
+    match_maker = MatchMaker(scheduler, max_matches=BATCH_SIZE + ABANDONED_PER_BATCH + LEFT_PER_BATCH, lobby_timeout_s=LOBBY_TIMEOUT_S)
+    winner_packets, loser_packets = packets(False), packets(True)
+    baseline = None
+    played = 0
+    start = time.perf_counter()
+    while played < total_matches:
+        await play_batch(match_maker, scheduler, winner_packets, loser_packets)
+        played += BATCH_SIZE
+        if played % REPORT_EVERY == 0:
+            gc.collect()
+            rss = rss_mb()
+            if played >= WARMUP_MATCHES and baseline is None:
+                baseline = rss
+            print(f"{played:>7} matches  rss {rss:7.1f}MB  {played / (time.perf_counter() - start):7.0f} matches/s  "
+                  f"open matches {len(match_maker.match_overview)}  scheduled {len(scheduler.matches)}  tracked players {len(match_maker.player_id_match_lookup)}", flush=True)
+    gc.collect()
+    growth = rss_mb() - baseline if baseline is not None else 0.0
+    print(f"RSS growth after warm up: {growth:.1f}MB (limit {MAX_RSS_GROWTH_MB}MB)")
+    return growth <= MAX_RSS_GROWTH_MB
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else MATCHES
+    sys.exit(0 if asyncio.run(main(total)) else 1)
@@ -1,5 +1,7 @@
 import logging
 from server import server
+from server.const.settings import SHARD_COUNT, UVICORN_LOOP
+from server.sharding import run_sharded
 from shared.utils.logging import init_logger
 import uvicorn
 
@@ -13,4 +15,7 @@ logger = logging.getLogger(__name__)
 
 def run():
     logger.info("Starting...")
-    uvicorn.run(server.app, port=PORT, host=HOST, log_level='warning')
+    if SHARD_COUNT > 1:
+        run_sharded(HOST, PORT, SHARD_COUNT)
+        return
+    uvicorn.run(server.app, port=PORT, host=HOST, log_level='warning', loop=UVICORN_LOOP)
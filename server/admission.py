@@ -0,0 +1,94 @@
+import logging
+import math
+from typing import Dict
+
+from server.const.settings import (
+    ADMISSION_RETRY_AFTER_S,
+    MAX_MATCHES,
+    MAX_QUEUE_SIZE,
+    QUEUE_JOIN_BURST,
+    QUEUE_JOIN_RATE_PER_S,
+)
+from server.metrics import ADMISSION_REJECTED
+
+# Buckets are only kept for clients seen recently, checked at most this often
+BUCKET_PRUNE_INTERVAL_S = 60
+
+class TokenBucket():
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def take(self, now: float) -> float:
+        """Take a token, returns 0 on success or the seconds until the next token is available"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated_at) * self.rate >= self.burst
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after_s: float) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after_s = retry_after_s
+
+    def retry_after_header(self) -> str:
+        # Retry-After only allows whole seconds
+        return str(max(1, math.ceil(self.retry_after_s)))
+
+class AdmissionController():
+    """
+    Sheds load before it reaches matchmaking: a per client token bucket on joins,
+    a bound on the queue and a bound on concurrently running matches.
+    Every check is O(1) so rejecting stays cheap during a reconnect storm.
+    """
+    def __init__(self, max_matches: int = MAX_MATCHES, max_queue_size: int = MAX_QUEUE_SIZE, join_rate_per_s: float = QUEUE_JOIN_RATE_PER_S, join_burst: float = QUEUE_JOIN_BURST) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.max_matches = max_matches
+        self.max_queue_size = max_queue_size
+        self.join_rate_per_s = join_rate_per_s
+        self.join_burst = join_burst
+        self.buckets: Dict[str, TokenBucket] = dict()
+        self.last_prune = 0.0
+
+    def check_join(self, client: str, already_queued: bool, queue_size: int, active_matches: int, now: float):
+        """Raises AdmissionRejected if the join should be turned away"""
+        if (bucket := self.buckets.get(client)) is None:
+            self.__prune(now)
+            bucket = TokenBucket(self.join_rate_per_s, self.join_burst, now)
+            self.buckets[client] = bucket
+        if (wait_s := bucket.take(now)) > 0:
+            self.__reject("rate_limited", wait_s)
+        # Joining again keeps the queue position, nothing new to admit
+        if already_queued:
+            return
+        if queue_size >= self.max_queue_size:
+            self.__reject("queue_full", ADMISSION_RETRY_AFTER_S)
+        # Players already queued keep waiting for a free slot, new ones are turned away
+        if active_matches >= self.max_matches:
+            self.__reject("matches_full", ADMISSION_RETRY_AFTER_S)
+
+    def reject_match(self):
+        """Counted for shards that refuse to adopt another match"""
+        ADMISSION_REJECTED.inc("matches_full")
+
+    def __reject(self, reason: str, retry_after_s: float):
+        ADMISSION_REJECTED.inc(reason)
+        raise AdmissionRejected(reason, retry_after_s)
+
+    def __prune(self, now: float):
+        if now - self.last_prune < BUCKET_PRUNE_INTERVAL_S:
+            return
+        self.last_prune = now
+        # A full bucket behaves exactly like a new one
+        for client in [client for client, bucket in self.buckets.items() if bucket.is_full(now)]:
+            del self.buckets[client]
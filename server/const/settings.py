@@ -0,0 +1,66 @@
+import os
+
+# Rate at which the shared scheduler processes all matches
+TICK_RATE_HZ = float(os.getenv("TICK_RATE_HZ", "60"))
+
+# "event" relays a packet as soon as it arrives, "tick" batches relaying into the scheduler tick
+RELAY_MODE = os.getenv("RELAY_MODE", "event")
+
+LOBBY_BROADCAST_INTERVAL_S = 1.0
+
+# Players of running matches are pinged this often, pings without pong after the timeout count as lost
+PING_INTERVAL_S = float(os.getenv("PING_INTERVAL_S", "1"))
+PING_TIMEOUT_S = 5.0
+
+# How often the event loop lag is sampled for /metrics
+LOOP_LAG_SAMPLE_INTERVAL_S = 0.5
+
+# Opt-in event loop profiling, reports slow callbacks with the match they belong to
+PROFILING_ENABLED = os.getenv("PROFILING", "0") == "1"
+# Slow callbacks are timed by patching the stock asyncio loop, uvloop (uvicorn's default when installed) bypasses that
+UVICORN_LOOP = "asyncio" if PROFILING_ENABLED else "auto"
+SLOW_CALLBACK_THRESHOLD_S = float(os.getenv("SLOW_CALLBACK_THRESHOLD_S", "0.01"))
+PROFILING_LAG_SAMPLE_INTERVAL_S = 0.05
+PROFILING_REPORT_INTERVAL_S = float(os.getenv("PROFILING_REPORT_INTERVAL_S", "60"))
+PROFILING_TOP_N = 10
+PROFILE_OUTPUT_DIR = os.getenv("PROFILE_OUTPUT_DIR", "/tmp/flow-profiles")
+MAX_PROFILE_WINDOW_S = 60.0
+# Admin routes are disabled while this is empty
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Per player outbound queue. Snapshots are merged once it is full, actions and control messages are never dropped
+MAX_OUTBOUND_QUEUE = 32
+# A receiver that cannot take a single message for this long is disconnected
+OUTBOUND_SEND_TIMEOUT_S = 5.0
+# How long queued messages may still be written before a connection is closed
+OUTBOUND_FLUSH_TIMEOUT_S = 1.0
+
+# Admission control, rejected requests get a 503 with Retry-After (websockets close with 1013)
+MAX_MATCHES = int(os.getenv("MAX_MATCHES", "500"))
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "1000"))
+# Token bucket per client address on POST /queue
+QUEUE_JOIN_RATE_PER_S = float(os.getenv("QUEUE_JOIN_RATE_PER_S", "1"))
+QUEUE_JOIN_BURST = 5
+ADMISSION_RETRY_AFTER_S = 5.0
+
+# Upper bound for GET /queue/{player_id}?wait=...
+MAX_QUEUE_LONG_POLL_S = 30.0
+
+# How often expired queue entries and finished matches are removed in the background
+REAPER_INTERVAL_S = float(os.getenv("REAPER_INTERVAL_S", "1"))
+# Lobbies still missing a player after this long are terminated and reaped, they would hold a match slot forever
+LOBBY_TIMEOUT_S = float(os.getenv("LOBBY_TIMEOUT_S", "30"))
+
+# Sharded deployment, SHARD_COUNT > 1 runs a router, a queue coordinator and one worker process per shard
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+# standalone | coordinator | shard (set by the router for its child processes)
+SERVER_ROLE = os.getenv("SERVER_ROLE", "standalone")
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_SECRET = os.getenv("SHARD_SECRET", "")
+SHARD_SOCKET_DIR = os.getenv("SHARD_SOCKET_DIR", "/tmp/flow-shards")
+# How long the coordinator remembers which match a player was sent to
+MATCH_TICKET_TTL_S = 60
+# MAX_MATCHES is split evenly between the shards, the coordinator only sends players to shards with room
+MAX_MATCHES_PER_SHARD = -(-MAX_MATCHES // SHARD_COUNT)
+# A new ticket counts against its shard until the shard reported the match itself
+TICKET_CONNECT_GRACE_S = 10.0
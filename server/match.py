@@ -1,35 +1,49 @@
 import asyncio
 import logging
+import time
 import uuid
 
 from fastapi import WebSocket, WebSocketDisconnect
 
+from server.const.settings import LOBBY_BROADCAST_INTERVAL_S, PING_INTERVAL_S, RELAY_MODE
+from server.metrics import RELAYED_BYTES, RELAYED_PACKETS
 from server.player import Player
+from server.profiling import CURRENT_MATCH_ID
 from shared.types.status_message import GameStatus, StatusMessages
+from shared.utils.logging import IdLoggerAdapter
 
-class Match():
-    player_1_slot: Player | None = None
-    player_2_slot: Player | None = None
-
-    lobby_ready = False
-    game_finished = False
-    terminated = False
-    is_primary = False
+LOGGER = logging.getLogger(__name__)
 
-    def __init__(self) -> None:
-        self.id = str(uuid.uuid4())
-        self.logger = logging.getLogger(f"{__name__}: {self.id}")
-        # run background task
-        asyncio.create_task(self.match_loop())
+class Match():
+    __slots__ = (
+        "id", "logger", "player_1_slot", "player_2_slot",
+        "lobby_ready", "game_started", "game_finished", "terminated",
+        "relay_event", "last_lobby_broadcast", "last_ping", "created_at",
+    )
+
+    def __init__(self, match_id: str | None = None) -> None:
+        self.id = match_id if match_id is not None else str(uuid.uuid4())
+        self.logger = IdLoggerAdapter(LOGGER, {"id": self.id})
+        self.player_1_slot: Player | None = None
+        self.player_2_slot: Player | None = None
+        self.lobby_ready = False
+        self.game_started = False
+        self.game_finished = False
+        self.terminated = False
+        # Set by either player whenever a new message arrives or a connection drops
+        self.relay_event = asyncio.Event()
+        self.last_lobby_broadcast = time.monotonic()
+        self.last_ping = 0.0
+        self.created_at = time.monotonic()
 
     async def __add_player(self, id: str, name: str, websocket: WebSocket):
         if self.player_1_slot is None:
-            self.player_1_slot = Player(id, name, websocket)
+            self.player_1_slot = Player(id, name, websocket, self.relay_event)
             await self.player_1_slot.send_control_message(GameStatus(message=StatusMessages.PLAYER_1))
             self.logger.debug("Player 1 joined")
             return self.player_1_slot
         else:
-            self.player_2_slot = Player(id, name, websocket)
+            self.player_2_slot = Player(id, name, websocket, self.relay_event)
             await self.player_2_slot.send_control_message(GameStatus(message=StatusMessages.PLAYER_2))
             self.logger.debug("Player 2 joined")
             self.lobby_ready = True
@@ -50,73 +64,152 @@ class Match():
 
     async def terminate(self):
         self.logger.info("Game terminated!")
+        # Flags first, the match counts as dead while the players are still being told
+        self.game_finished = True
+        self.lobby_ready = True
+        self.terminated = True
+        self.relay_event.set()
         if self.player_1_slot is not None:
             await self.player_1_slot.send_control_message(GameStatus(StatusMessages.TERMINATED))
             await self.player_1_slot.disconnect()
         if self.player_2_slot is not None:
             await self.player_2_slot.send_control_message(GameStatus(StatusMessages.TERMINATED))
             await self.player_2_slot.disconnect()
-        self.game_finished = True
-        self.lobby_ready = True
-        self.terminated = True
 
     def ready_to_die(self) -> bool:
         return self.game_finished or self.terminated
 
-    async def match_loop(self):
-        while not self.lobby_ready:
-            await asyncio.sleep(1)
-            # This can only happen for first player...
-            await self.__safe_broadcast(GameStatus(StatusMessages.LOBBY_WAITING))
+    def is_due(self, now: float) -> bool:
+        """Cheap check for the scheduler, tick is only called when it has something to do"""
+        # Arrivals and disconnects both set the event
+        if self.ready_to_die() or self.relay_event.is_set():
+            return True
+        if not self.lobby_ready:
+            return now - self.last_lobby_broadcast >= LOBBY_BROADCAST_INTERVAL_S
+        return not self.game_started or now - self.last_ping >= PING_INTERVAL_S
+
+    async def tick(self, now: float):
+        """One scheduler pass: lobby broadcasts, game start, win detection and (in tick mode) relay"""
+        if self.ready_to_die():
+            return
 
+        if not self.lobby_ready:
+            # The waiting player left, the empty lobby would keep its match slot until the lobby timeout
+            if self.relay_event.is_set():
+                self.relay_event.clear()
+                if self.player_1_slot is not None and not self.player_1_slot.is_still_in_match():
+                    self.logger.info("Player 1 left the lobby before an opponent joined")
+                    await self.terminate()
+                    return
+            if now - self.last_lobby_broadcast >= LOBBY_BROADCAST_INTERVAL_S:
+                self.last_lobby_broadcast = now
+                # This can only happen for first player...
+                await self.__safe_broadcast(GameStatus(StatusMessages.LOBBY_WAITING))
+            return
+
+        if not self.game_started:
+            await self.__start_game()
+            return
+
+        if self.relay_event.is_set():
+            self.relay_event.clear()
+            if await self.__check_disconnect_victory():
+                return
+            if RELAY_MODE == "tick":
+                await self.relay()
+
+        if now - self.last_ping >= PING_INTERVAL_S:
+            self.last_ping = now
+            await self.__ping_players()
+
+    async def __ping_players(self):
+        try:
+            await asyncio.gather(self.player_1_slot.ping(), self.player_2_slot.ping())
+        except Exception as e:
+            self.logger.debug(f"Could not ping players: {e}")
+
+    def latency_record(self) -> dict:
+        """Per match connection quality, one entry per player"""
+        return {
+            "match_id": self.id,
+            "duration_s": round(time.monotonic() - self.created_at, 1),
+            "players": {
+                player.id: {**player.latency.summary(), "outbound": player.outbound_summary()}
+                for player in (self.player_1_slot, self.player_2_slot) if player is not None
+            },
+        }
+
+    def on_removed(self):
+        """Called by the scheduler once the match is dropped"""
+        self.logger.info(f"Match record {self.latency_record()}")
+
+    async def __start_game(self):
         self.logger.debug("All players joined! Starting game...")
         await self.player_1_slot.send_control_message(GameStatus(StatusMessages.PLAYER_NAME, self.player_2_slot.name))
         await self.player_2_slot.send_control_message(GameStatus(StatusMessages.PLAYER_NAME, self.player_1_slot.name))
         await self.__broadcast(GameStatus("lobby_starting"))
-        while not self.game_finished and not self.terminated:
-            if not self.player_1_slot.is_still_in_match():
-                self.logger.debug("Player 2 won because player 1 is no longer connected")
-                await self.player_2_slot.declare_victor()
-                self.game_finished = True
-                continue
-            if not self.player_2_slot.is_still_in_match():
-                self.logger.debug("Player 1 won because player 1 is no longer connected")
-                await self.player_1_slot.declare_victor()
+        self.game_started = True
+        # Relay whatever was sent while waiting for the start
+        await self.relay()
+
+    async def __check_disconnect_victory(self) -> bool:
+        if not self.player_1_slot.is_still_in_match():
+            self.logger.debug("Player 2 won because player 1 is no longer connected")
+            self.game_finished = True
+            await self.player_2_slot.declare_victor()
+            return True
+        if not self.player_2_slot.is_still_in_match():
+            self.logger.debug("Player 1 won because player 1 is no longer connected")
+            self.game_finished = True
+            await self.player_1_slot.declare_victor()
+            return True
+        return False
+
+    async def relay(self):
+        """Forward pending messages in both directions"""
+        await asyncio.gather(
+            self.__relay(self.player_1_slot, self.player_2_slot),
+            self.__relay(self.player_2_slot, self.player_1_slot),
+        )
+
+    async def __relay(self, sender: Player, receiver: Player):
+        if self.game_finished or self.terminated:
+            return
+        try:
+            received_at = sender.last_message_at
+            if (msg:=sender.flush_last_message()) is None:
+                return
+            send_tasks = [receiver.send_player_info(msg, received_at)]
+            if msg.health <= 0.0:
+                send_tasks.append(receiver.declare_victor())
+                send_tasks.append(sender.declare_loser())
                 self.game_finished = True
-                continue
-
-            try:
-                send_tasks = []
-                if (p1_msg:=self.player_1_slot.flush_last_message()) is not None:
-                    send_tasks.append(self.player_2_slot.send_player_info(p1_msg))
-                    if p1_msg.health <= 0.0:
-                        send_tasks.append(self.player_2_slot.declare_victor())
-                        send_tasks.append(self.player_1_slot.declare_loser())
-                        self.game_finished = True
-                if (p2_msg:=self.player_2_slot.flush_last_message()) is not None:
-                    send_tasks.append(self.player_1_slot.send_player_info(p2_msg))
-                    if p2_msg.health <= 0.0:
-                        send_tasks.append(self.player_1_slot.declare_victor())
-                        send_tasks.append(self.player_2_slot.declare_loser())
-                        self.game_finished = True
-
-                if len(send_tasks) > 0:
-                    await asyncio.gather(*send_tasks)
-                else:
-                    await asyncio.sleep(0.001)
-
-            except WebSocketDisconnect: 
-               self.logger.info("One player left mid match...the remaining player will be declared the winner")
-            except Exception as e:
-                self.logger.warning(f"An error occured when communicating actions between players. This likely means a player has disconnected. {e}")
-
-        self.logger.debug("Game finished")
+                self.logger.debug("Game finished")
+            await asyncio.gather(*send_tasks)
+            RELAYED_PACKETS.inc()
+            RELAYED_BYTES.inc(len(msg.data))
+        except WebSocketDisconnect: 
+            self.logger.info("One player left mid match...the remaining player will be declared the winner")
+        except Exception as e:
+            self.logger.warning(f"An error occured when communicating actions between players. This likely means a player has disconnected. {e}")
+
+    def __opponent_of(self, player: Player) -> Player | None:
+        if player is self.player_1_slot:
+            return self.player_2_slot
+        return self.player_1_slot
 
     async def accept_player(self, id: str, name:str, websocket: WebSocket):
+        CURRENT_MATCH_ID.set(self.id)
         player = await self.__add_player(id, name, websocket)
 
-        while not self.game_finished and not self.terminated:
-            await player.receive_data()
-            await player.flush_outgoing_buffer()
-
-
+        try:
+            while not self.game_finished and not self.terminated:
+                await player.receive_data()
+                # Event mode forwards straight from the receiving connection, no waiting on a tick
+                if RELAY_MODE == "event" and self.game_started:
+                    await self.__relay(player, self.__opponent_of(player))
+        finally:
+            # Let the next tick notice a disconnect
+            self.relay_event.set()
+            # Final messages like victory or defeat are still queued at this point
+            await player.close_outbound()
@@ -1,89 +1,235 @@
+import asyncio
+import heapq
 import logging
-from typing import Dict, Tuple
+from typing import Dict, List, Tuple
 import time
 
+from server.const.settings import LOBBY_TIMEOUT_S, MATCH_TICKET_TTL_S, MAX_MATCHES, REAPER_INTERVAL_S, SERVER_ROLE, SHARD_COUNT, SHARD_INDEX
 from server.match import Match
+from server.metrics import MATCHES_CREATED, REAPED, REAPER_PASS_DURATION
+from server.player_queue import PlayerQueue
+from server.scheduler import TickScheduler
+from server.sharding import MatchTicket, ShardBalancer, ShardLoad
 from shared.const.queue_status import QueueStatus
 
 PLAYER_LIVETIME_S = 5
 
 class MatchMaker():
-    def __init__(self) -> None:
-        self.queued_players = set()
-        self.queued_players_live = dict()
-        self.match_overview: Dict[str, Match] = dict()
+    def __init__(self, scheduler: TickScheduler, max_matches: int = MAX_MATCHES, shard_load: ShardLoad | None = None, lobby_timeout_s: float = LOBBY_TIMEOUT_S) -> None:
+        self.scheduler = scheduler
+        # Per shard when sharded
+        self.max_matches = max_matches
+        # Shards publish their live matches, the coordinator places tickets by them
+        self.shard_load = shard_load
+        self.balancer = ShardBalancer(shard_load, max_matches) if SERVER_ROLE == "coordinator" and shard_load is not None else None
+        self.queue = PlayerQueue(PLAYER_LIVETIME_S)
+        self.match_overview: Dict[str, Match | MatchTicket] = dict()
+        self.match_players: Dict[str, Tuple[str, str]] = dict()
         self.player_id_match_lookup = dict()
+        # Filled by the scheduler, so cleanup never has to scan all matches
+        self.finished_match_ids: List[str] = []
+        # (deadline, match id) for coordinator tickets which are not driven by the scheduler
+        self.ticket_expiry: List[Tuple[float, str]] = []
+        # (deadline, match id) for scheduled matches, lobbies still waiting for a player at the deadline are terminated
+        self.lobby_timeout_s = lobby_timeout_s
+        self.lobby_expiry: List[Tuple[float, str]] = []
         self.logger = logging.getLogger(__name__)
+        self.scheduler.add_finished_listener(self.__match_finished)
+        self.reaper_task: asyncio.Task | None = None
+        # Long polling players, set once their status changes
+        self.status_waiters: Dict[str, asyncio.Event] = dict()
 
     def add_player(self, player_id: str):
-        self.logger.info(f"New player in queue ({player_id}). Currently {len(self.queued_players)+1} in queue (Pending cleanup)")
-        self.queued_players.add(player_id)
-        self.queued_players_live[player_id] = time.time()
-        self.__try_to_match()
+        self.queue.push(player_id, time.monotonic())
+        self.logger.info(f"New player in queue ({player_id}). Currently {len(self.queue)} in queue (Pending cleanup)")
+        # Expired entries are left to the reaper, joins only pair
+        self.__pair_waiting_players()
 
     def remove_player(self, player_id: str):
-        if player_id in self.queued_players:
-            self.queued_players.remove(player_id)
-            del self.queued_players_live[player_id]
-            self.logger.info(f"Player left queue ({player_id}). Currently {len(self.queued_players)} in queue...")
+        if self.queue.remove(player_id):
+            self.logger.info(f"Player left queue ({player_id}). Currently {len(self.queue)} in queue...")
+            self.__notify_status_change(player_id)
             return
         if player_id in self.player_id_match_lookup:
             match_id = self.player_id_match_lookup[player_id]
             self.logger.info(f"Player left in limbo between game and queue ({player_id}). Terminating game ({match_id})...")
             del self.player_id_match_lookup[player_id]
-            _ = self.match_overview[match_id].terminate()
+            if (match := self.match_overview.get(match_id)) is not None:
+                asyncio.create_task(match.terminate())
+                self.finished_match_ids.append(match_id)
 
-    def cleanup(self):
-        self.__queue_cleanup()
-        self.__match_cleanup()
+    def __match_finished(self, match_id: str):
+        # Not bound to the list itself, cleanup swaps in a fresh list on every pass
+        self.finished_match_ids.append(match_id)
+        self.__publish_load()
 
-    def __queue_cleanup(self):
+    def __publish_load(self):
+        if SERVER_ROLE == "shard" and self.shard_load is not None:
+            self.shard_load.publish(SHARD_INDEX, len(self.scheduler.matches))
+
+    def cleanup(self) -> Tuple[int, int]:
+        return (self.__queue_cleanup(), self.__match_cleanup())
+
+    def start_reaper(self, interval_s: float = REAPER_INTERVAL_S):
+        if self.reaper_task is None:
+            self.reaper_task = asyncio.create_task(self.__reaper_loop(interval_s))
+
+    async def stop_reaper(self):
+        if self.reaper_task is None:
+            return
+        self.reaper_task.cancel()
+        try:
+            await self.reaper_task
+        except asyncio.CancelledError:
+            pass
+        self.reaper_task = None
+
+    async def __reaper_loop(self, interval_s: float):
+        """Cleanup independent of joins, so memory stays bounded while nobody queues"""
+        while True:
+            await asyncio.sleep(interval_s)
+            start = time.perf_counter()
+            try:
+                reaped_players, reaped_matches = self.cleanup()
+            except Exception as e:
+                self.logger.warning(f"Reaper pass failed: {e}")
+                continue
+            duration = time.perf_counter() - start
+            REAPER_PASS_DURATION.observe(duration)
+            REAPED.inc("queue_entry", reaped_players)
+            REAPED.inc("match", reaped_matches)
+            # Freed match slots go to players that were waiting for capacity
+            self.__pair_waiting_players()
+            if reaped_players + reaped_matches > 0:
+                self.logger.info(f"Reaped {reaped_players} queue entries and {reaped_matches} matches in {duration * 1000:.2f}ms")
+
+    def __queue_cleanup(self) -> int:
         """Remove dead players from queue"""
-        cleanup_ids = []
-        for player_id, last_heartbeat in self.queued_players_live.items():
-            if time.time() - last_heartbeat > PLAYER_LIVETIME_S:
-                cleanup_ids.append(player_id)
-        for id in cleanup_ids:
-            del self.queued_players_live[id]
-            self.queued_players.remove(id)
+        expired = self.queue.expire(time.monotonic())
+        for player_id in expired:
+            self.__notify_status_change(player_id)
+        if len(expired) > 0:
+            self.logger.debug(f"Removed {len(expired)} from queue")
+        return len(expired)
 
-        if len(cleanup_ids) > 0:
-            self.logger.info(f"Removed {len(cleanup_ids)} from queue")
+    def __match_cleanup(self) -> int:
+        """Remove finished/terminated matches and abandoned lobbies from queue"""
+        now = time.monotonic()
+        while len(self.ticket_expiry) > 0 and self.ticket_expiry[0][0] <= now:
+            _, match_id = heapq.heappop(self.ticket_expiry)
+            self.finished_match_ids.append(match_id)
+        while len(self.lobby_expiry) > 0 and self.lobby_expiry[0][0] <= now:
+            _, match_id = heapq.heappop(self.lobby_expiry)
+            self.__expire_lobby(match_id)
 
-    def __match_cleanup(self):
-        """Remove finished/terminated matches from queue"""
-        cleanup_ids = []
-        for match_id, match in self.match_overview.items():
-            if match.ready_to_die():
-                cleanup_ids.append(match_id)
+        cleanup_ids, self.finished_match_ids = self.finished_match_ids, []
+        removed = 0
         for id in cleanup_ids:
-            match = self.match_overview.pop(id)
-            if match.player_1_slot is not None:
-                del self.player_id_match_lookup[match.player_1_slot.id]
-            if match.player_2_slot is not None:
-                del self.player_id_match_lookup[match.player_2_slot.id]
-
-        if len(cleanup_ids) > 0:
-            self.logger.info(f"Removed {len(cleanup_ids)} from match pool")
-
-    def __try_to_match(self):
-        self.cleanup()
-        # couldn't match
-        if len(self.queued_players) < 2:
+            if (match := self.match_overview.pop(id, None)) is None:
+                continue
+            removed += 1
+            # Matches ended by a leaving player are still scheduled, counted and logged like any other
+            if isinstance(match, Match):
+                self.scheduler.finish_match(match)
+            # Players that never connected to the match are in here as well
+            for player_id in self.match_players.pop(id, ()):
+                if self.player_id_match_lookup.get(player_id) == id:
+                    del self.player_id_match_lookup[player_id]
+
+        if removed > 0:
+            self.logger.debug(f"Removed {removed} from match pool")
+        return removed
+
+    def __expire_lobby(self, match_id: str):
+        match = self.match_overview.get(match_id)
+        # Started games and matches that already ended are not lobbies anymore
+        if not isinstance(match, Match) or match.lobby_ready or match.ready_to_die():
             return
-        match = Match()
-        self.match_overview[match.id] = match
-        #TODO: Does this need locking when a lot of players connect?
-        player_1, player_2 = self.queued_players.pop(), self.queued_players.pop()
+        self.logger.info(f"Lobby {match_id} still missing a player after {self.lobby_timeout_s}s, terminating")
+        asyncio.create_task(match.terminate())
+        # Frees the slot right away, the listener queues the match for removal below
+        self.scheduler.finish_match(match)
+
+    def active_match_count(self) -> int:
+        # Matches of a sharded server live in the shard processes
+        if self.balancer is not None:
+            return self.balancer.active_match_count(time.monotonic())
+        return len(self.scheduler.matches)
+
+    def has_match_capacity(self) -> bool:
+        if self.balancer is not None:
+            return self.balancer.pick_shard(time.monotonic()) is not None
+        return self.active_match_count() < self.max_matches
+
+    def __pair_waiting_players(self):
+        # Longest waiting players are paired first, the rest stays queued while the server is full
+        while self.has_match_capacity() and (pair := self.queue.pop_pair()) is not None:
+            self.__start_match(*pair)
+
+    def __start_match(self, player_1: str, player_2: str):
+        match = self.__create_match()
+        self.match_players[match.id] = (player_1, player_2)
         self.player_id_match_lookup[player_1] = match.id
         self.player_id_match_lookup[player_2] = match.id
-        del self.queued_players_live[player_1]
-        del self.queued_players_live[player_2]
-        self.logger.info(f"New match created ({match.id}). Currently {len(self.queued_players)} in queue...")
+        self.__notify_status_change(player_1)
+        self.__notify_status_change(player_2)
+        self.logger.info(f"New match created ({match.id}). Currently {len(self.queue)} in queue...")
+
+    def __create_match(self) -> Match | MatchTicket:
+        # The actual match is created by the shard the players connect to
+        if SERVER_ROLE == "coordinator":
+            # Capacity was checked before pairing, so there is a shard with room
+            now = time.monotonic()
+            shard_index = self.balancer.pick_shard(now) if self.balancer is not None else 0
+            match = MatchTicket(shard_index, SHARD_COUNT)
+            if self.balancer is not None:
+                self.balancer.reserve(shard_index, now)
+            heapq.heappush(self.ticket_expiry, (match.created_at + MATCH_TICKET_TTL_S, match.id))
+        else:
+            match = Match()
+            self.__schedule(match)
+        MATCHES_CREATED.inc()
+        self.match_overview[match.id] = match
+        return match
+
+    def adopt_match(self, match_id: str) -> Match:
+        """Shard side: the coordinator hands out match ids, the first player to connect creates the match here"""
+        if (match := self.match_overview.get(match_id)) is not None:
+            return match
+        match = Match(match_id)
+        self.match_overview[match.id] = match
+        self.__schedule(match)
+        MATCHES_CREATED.inc()
+        self.__publish_load()
+        self.logger.info(f"Adopted match ({match.id}) from coordinator")
+        return match
+
+    def __schedule(self, match: Match):
+        self.scheduler.add_match(match)
+        heapq.heappush(self.lobby_expiry, (match.created_at + self.lobby_timeout_s, match.id))
+
+    async def wait_for_status_change(self, player_id: str, timeout_s: float):
+        """Block until the player is no longer waiting in the queue or the timeout passed"""
+        if player_id not in self.queue:
+            return
+        # A pending long poll counts as heartbeat for its whole duration
+        self.queue.touch(player_id, time.monotonic(), extra_s=timeout_s)
+        if (event := self.status_waiters.get(player_id)) is None:
+            event = asyncio.Event()
+            self.status_waiters[player_id] = event
+        # Every way out of the queue notifies, so waiters never outlive their queue entry
+        try:
+            await asyncio.wait_for(event.wait(), timeout_s)
+        except asyncio.TimeoutError:
+            pass
+
+    def __notify_status_change(self, player_id: str):
+        if (event := self.status_waiters.pop(player_id, None)) is not None:
+            event.set()
 
     def get_player_status(self, player_id: str) -> Tuple[QueueStatus, str]:
-        if player_id in self.queued_players:
-            self.queued_players_live[player_id] = time.time()
+        if player_id in self.queue:
+            self.queue.touch(player_id, time.monotonic())
             return (QueueStatus.IN_QUEUE, "")
         if player_id in self.player_id_match_lookup:
             player_match = self.match_overview.get(self.player_id_match_lookup[player_id])
@@ -96,6 +242,18 @@ class MatchMaker():
             return (QueueStatus.MATCHED, player_match.id)
         return (QueueStatus.UNKNOWN, "")
 
+    def matches_by_state(self) -> Dict[str, int]:
+        """Counted at scrape time, finished matches stay in here until the reaper drops them"""
+        counts = {"lobby": 0, "running": 0, "finished": 0}
+        for match in self.match_overview.values():
+            if match.ready_to_die():
+                counts["finished"] += 1
+            elif getattr(match, "game_started", False):
+                counts["running"] += 1
+            else:
+                counts["lobby"] += 1
+        return counts
+
     def is_valid_match_id(self, match_id: str) -> bool:
         return match_id in self.match_overview
 
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from server.const.settings import LOOP_LAG_SAMPLE_INTERVAL_S
+
+# Seconds, shared by the latency style histograms below
+LATENCY_BUCKETS_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+RTT_BUCKETS_S = (0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if len(labels) == 0:
+        return ""
+    # Label values are only ever our own state names and bucket bounds, nothing needs escaping
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Counter():
+    """Monotonic counter, incrementing is a single attribute update"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        yield (self.name, {}, self.value)
+
+class LabeledCounter():
+    """Counter family with a single label, children are created on first use"""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label: str) -> None:
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values: Dict[str, float] = dict()
+
+    def inc(self, label_value: str, amount: float = 1.0):
+        self.values[label_value] = self.values.get(label_value, 0.0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for label_value, value in self.values.items():
+            yield (self.name, {self.label: label_value}, value)
+
+class Gauge():
+    """Current value, either set directly or read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, callback: Callable[[], float] | None = None) -> None:
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self.callback = callback
+
+    def set(self, value: float):
+        self.value = value
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        yield (self.name, {}, self.callback() if self.callback is not None else self.value)
+
+class LabeledGauge():
+    """Gauge family whose values are all produced by one callback returning label value -> value"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, label: str, callback: Callable[[], Dict[str, float]] | None = None) -> None:
+        self.name = name
+        self.help = help
+        self.label = label
+        self.callback = callback
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        if self.callback is None:
+            return
+        for label_value, value in self.callback().items():
+            yield (self.name, {self.label: label_value}, value)
+
+class Histogram():
+    """Cumulative buckets are only built at scrape time, observing is a bisect and two additions"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS_S) -> None:
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # Last slot counts observations above the largest bucket
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            yield (f"{self.name}_bucket", {"le": _format_value(upper_bound)}, cumulative)
+        yield (f"{self.name}_sum", {}, self.sum)
+        yield (f"{self.name}_count", {}, cumulative)
+
+class Registry():
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Counter | LabeledCounter | Gauge | LabeledGauge | Histogram] = dict()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} registered twice")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# Scrape time values, callbacks are wired up by the server once matchmaking exists
+QUEUE_DEPTH = REGISTRY.register(Gauge("flow_queue_depth", "Players waiting in the queue"))
+MATCHES = REGISTRY.register(LabeledGauge("flow_matches", "Known matches by state", "state"))
+
+# Hot path counters
+MATCHES_CREATED = REGISTRY.register(Counter("flow_matches_created_total", "Matches created or adopted"))
+MATCHES_FINISHED = REGISTRY.register(Counter("flow_matches_finished_total", "Matches removed from the scheduler"))
+RELAYED_PACKETS = REGISTRY.register(Counter("flow_relayed_packets_total", "Player info packets forwarded to the opponent"))
+RELAYED_BYTES = REGISTRY.register(Counter("flow_relayed_bytes_total", "Player info bytes forwarded to the opponent"))
+RECEIVED_PACKETS = REGISTRY.register(Counter("flow_received_packets_total", "Player info packets received from clients"))
+DECODE_FAILURES = REGISTRY.register(Counter("flow_decode_failures_total", "Binary payloads that could not be parsed as player info"))
+RELAY_LATENCY = REGISTRY.register(Histogram("flow_relay_latency_seconds", "Time between receiving a packet and writing it to the other player"))
+OUTBOUND_COALESCED = REGISTRY.register(Counter("flow_outbound_coalesced_total", "Stale snapshots merged into a newer one before sending"))
+OUTBOUND_OVERFLOWS = REGISTRY.register(Counter("flow_outbound_overflows_total", "Messages queued for a player whose outbound queue was full"))
+OUTBOUND_SEND_TIMEOUTS = REGISTRY.register(Counter("flow_outbound_send_timeouts_total", "Players disconnected because they stopped reading"))
+OUTBOUND_WAIT = REGISTRY.register(Histogram("flow_outbound_wait_seconds", "Time a message spent in the outbound queue"))
+PLAYER_RTT = REGISTRY.register(Histogram("flow_player_rtt_seconds", "Ping round trip to the clients", RTT_BUCKETS_S))
+
+ADMISSION_REJECTED = REGISTRY.register(LabeledCounter("flow_admission_rejected_total", "Joins and connections turned away by admission control", "reason"))
+
+# Server health
+TICK_DURATION = REGISTRY.register(Histogram("flow_tick_duration_seconds", "Duration of one scheduler pass over all matches"))
+TICK_OVERRUNS = REGISTRY.register(Counter("flow_tick_overruns_total", "Scheduler passes that took longer than the tick interval"))
+REAPED = REGISTRY.register(LabeledCounter("flow_reaped_total", "Expired queue entries and finished matches removed by the reaper", "kind"))
+REAPER_PASS_DURATION = REGISTRY.register(Histogram("flow_reaper_pass_seconds", "Duration of one reaper pass"))
+LOOP_LAG = REGISTRY.register(Histogram("flow_event_loop_lag_seconds", "How late the event loop woke up a sleeping task"))
+
+async def monitor_loop_lag(interval_s: float = LOOP_LAG_SAMPLE_INTERVAL_S):
+    """Sleep for a fixed interval and record how much later than requested the loop got back to us"""
+    logger = logging.getLogger(__name__)
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval_s)
+        lag = max(0.0, time.perf_counter() - start - interval_s)
+        LOOP_LAG.observe(lag)
+        if lag > interval_s:
+            logger.warning(f"Event loop lagged {lag * 1000:.2f}ms behind")
@@ -1,66 +1,204 @@
+import asyncio
 import json
 import logging
-from fastapi import WebSocket
+import time
+from collections import deque
+from typing import Deque, Tuple
+from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.websockets import WebSocketState
 from dataclasses import asdict
 
-from shared.types.player_info import PlayerInfo
+from shared.types.player_info import RawPlayerInfo
 from shared.types.status_message import GameStatus, StatusMessages 
-from shared.utils.validation import parse_player_info, enum_friendly_factory
+from shared.utils.latency import LatencyTracker
+from shared.utils.validation import merge_raw_player_info, parse_game_status, parse_raw_player_info, enum_friendly_factory
+from server.const.settings import MAX_OUTBOUND_QUEUE, OUTBOUND_FLUSH_TIMEOUT_S, OUTBOUND_SEND_TIMEOUT_S, PING_TIMEOUT_S
+from server.metrics import DECODE_FAILURES, OUTBOUND_COALESCED, OUTBOUND_OVERFLOWS, OUTBOUND_SEND_TIMEOUTS, OUTBOUND_WAIT, PLAYER_RTT, RECEIVED_PACKETS, RELAY_LATENCY
+from shared.utils.logging import IdLoggerAdapter
+
+LOGGER = logging.getLogger(__name__)
 
 class Player:
-    def __init__(self,player_id: str, player_name: str, websocket: WebSocket) -> None:
+    __slots__ = (
+        "ws", "id", "name", "logger", "last_message", "last_message_at", "health", "relay_event", "latency",
+        "outbound", "outbound_ready", "outbound_drained", "coalesced_count", "overflow_count", "writer_task",
+    )
+
+    def __init__(self,player_id: str, player_name: str, websocket: WebSocket, relay_event: asyncio.Event) -> None:
         self.ws: WebSocket = websocket
         self.id = player_id
         self.name = player_name
-        self.logger = logging.getLogger(f"{__name__}-{self.id}")
-        self.last_message: PlayerInfo | None = None
-        self.queued_message: PlayerInfo | None = None
+        self.logger = IdLoggerAdapter(LOGGER, {"id": self.id})
+        # Packets are relayed as received, only the header is peeked for health and actions
+        self.last_message: RawPlayerInfo | None = None
+        # Arrival of the oldest packet merged into last_message
+        self.last_message_at = 0.0
+        # Delta packets only carry health when it changes
+        self.health = 1
+        # Shared with the match, wakes the relay as soon as something arrives
+        self.relay_event = relay_event
+        self.latency = LatencyTracker(PING_TIMEOUT_S)
+        # (enqueue time, player info or encoded control message, arrival at the server of relayed player info),
+        # written by a dedicated task so a slow receiver only ever delays its own messages
+        self.outbound: Deque[Tuple[float, RawPlayerInfo | str, float | None]] = deque()
+        self.outbound_ready = asyncio.Event()
+        self.outbound_drained = asyncio.Event()
+        self.outbound_drained.set()
+        self.coalesced_count = 0
+        self.overflow_count = 0
+        self.writer_task = asyncio.create_task(self.__write_loop())
+
+    async def send_player_info(self, player_info: RawPlayerInfo, received_at: float):
+        """received_at is when the sender's packet arrived, the relay latency is measured from there to the actual send"""
+        if len(self.outbound) > 0 and isinstance(self.outbound[-1][1], RawPlayerInfo):
+            # Newer state replaces the stale snapshot, actions of both are kept
+            if self.__merge_into(len(self.outbound) - 1, player_info, received_at):
+                return
+        if len(self.outbound) >= MAX_OUTBOUND_QUEUE:
+            self.overflow_count += 1
+            OUTBOUND_OVERFLOWS.inc()
+            # Full: fold into the newest queued snapshot, even if control messages were queued after it
+            for index in range(len(self.outbound) - 1, -1, -1):
+                if isinstance(self.outbound[index][1], RawPlayerInfo) and self.__merge_into(index, player_info, received_at):
+                    return
+        self.__enqueue(player_info, received_at)
+
+    async def send_control_message(self, message: GameStatus):
+        # Never dropped, the queue only exceeds its bound by control messages
+        if len(self.outbound) >= MAX_OUTBOUND_QUEUE:
+            self.overflow_count += 1
+            OUTBOUND_OVERFLOWS.inc()
+        self.__enqueue(json.dumps(asdict(message, dict_factory=enum_friendly_factory)))
+
+    def __merge_into(self, index: int, player_info: RawPlayerInfo, received_at: float) -> bool:
+        queued_at, queued, queued_received_at = self.outbound[index]
+        if (merged := merge_raw_player_info(queued, player_info)) is None:
+            return False
+        # Keeps the original enqueue and arrival times, the metrics show how stale the state got
+        self.outbound[index] = (queued_at, merged, min(queued_received_at, received_at))
+        self.coalesced_count += 1
+        OUTBOUND_COALESCED.inc()
+        return True
+
+    def __enqueue(self, message: RawPlayerInfo | str, received_at: float | None = None):
+        self.outbound.append((time.perf_counter(), message, received_at))
+        self.outbound_drained.clear()
+        self.outbound_ready.set()
 
-    async def send_player_info(self, player_info: PlayerInfo):
-        await self.ws.send_bytes(player_info.to_bytes())
+    async def __write_loop(self):
+        while True:
+            if len(self.outbound) == 0:
+                self.outbound_drained.set()
+                self.outbound_ready.clear()
+                await self.outbound_ready.wait()
+                continue
+            queued_at, message, received_at = self.outbound.popleft()
+            OUTBOUND_WAIT.observe(time.perf_counter() - queued_at)
+            try:
+                # Unlike wait_for on 3.11, a timeout block never swallows a cancel that races a finished send
+                async with asyncio.timeout(OUTBOUND_SEND_TIMEOUT_S):
+                    if isinstance(message, str):
+                        await self.ws.send_text(message)
+                    else:
+                        await self.ws.send_bytes(message.data)
+            except TimeoutError:
+                OUTBOUND_SEND_TIMEOUTS.inc()
+                self.logger.warning(f"Receiver stopped reading for {OUTBOUND_SEND_TIMEOUT_S}s with {len(self.outbound)} messages queued, disconnecting")
+                self.__stop_writing()
+                await self.__close_quietly()
+                return
+            except Exception as e:
+                self.logger.debug(f"Outbound write failed, connection is gone: {e}")
+                self.__stop_writing()
+                return
+            if received_at is not None:
+                RELAY_LATENCY.observe(time.perf_counter() - received_at)
 
-    async def __send_player_info(self, player_info: PlayerInfo):
-        if self.queued_message is None:
-            self.queued_message = player_info
+    def __stop_writing(self):
+        self.outbound.clear()
+        self.outbound_drained.set()
+        # Lets the match notice the dead connection on its next pass
+        self.relay_event.set()
+
+    async def flush_outbound(self, timeout_s: float = OUTBOUND_FLUSH_TIMEOUT_S):
+        """Wait until everything queued so far was written, gives up after the timeout"""
+        if self.writer_task.done():
             return
-        self.queued_message = self.__merge_messages(player_info, self.queued_message)
+        try:
+            await asyncio.wait_for(self.outbound_drained.wait(), timeout_s)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Gave up flushing {len(self.outbound)} outbound messages")
 
-    async def send_control_message(self, message: GameStatus):
-        await self.ws.send_text(json.dumps(asdict(message, dict_factory=enum_friendly_factory)))
+    async def close_outbound(self):
+        await self.flush_outbound()
+        self.writer_task.cancel()
+        try:
+            await self.writer_task
+        except asyncio.CancelledError:
+            pass
+
+    def outbound_summary(self) -> dict:
+        return {"coalesced": self.coalesced_count, "overflows": self.overflow_count}
 
     async def receive_data(self):
         msg = await self.ws.receive()
-        if "bytes" not in msg:
+        if msg.get("type") == "websocket.disconnect":
+            self.relay_event.set()
+            raise WebSocketDisconnect(msg.get("code", 1000))
+        if msg.get("text") is not None:
+            await self.__handle_control_message(msg["text"])
+            return None
+        if msg.get("bytes") is None:
+            DECODE_FAILURES.inc()
             self.logger.warning(f"Invalid payload received {msg}")
             return None
-        parsed_msg = parse_player_info(msg["bytes"]) 
+        parsed_msg = parse_raw_player_info(msg["bytes"], self.health) 
         if parsed_msg is None:
+            DECODE_FAILURES.inc()
             self.logger.warning("Unparseable payload received")
             return
+        RECEIVED_PACKETS.inc()
+        self.health = parsed_msg.health
         if self.last_message is None:
             self.last_message = parsed_msg
+            self.last_message_at = time.perf_counter()
+        else:
+            # Priority packages are in action! Prepend already saved actions, the bytes are only rebuilt in this case
+            merged_msg = merge_raw_player_info(self.last_message, parsed_msg)
+            if merged_msg is None:
+                self.logger.warning("Client switched packet encoding mid match, dropped pending packet")
+                merged_msg = parsed_msg
+            self.last_message = merged_msg
+        self.relay_event.set()
+
+    async def __handle_control_message(self, raw: str):
+        if (status := parse_game_status(raw)) is None:
+            self.logger.warning(f"Invalid control message received {raw}")
             return
-        # Priority packages are in action!
-        self.last_message = self.__merge_messages(parsed_msg, self.last_message)
+        match status.message:
+            case StatusMessages.PING.value:
+                # Answer right away, the client measures its round trip with this
+                await self.send_control_message(GameStatus(StatusMessages.PONG, status.detail))
+            case StatusMessages.PONG.value:
+                try:
+                    rtt = self.latency.record_pong(int(status.detail), time.monotonic())
+                except ValueError:
+                    self.logger.warning(f"Pong with invalid sequence {status.detail}")
+                    return
+                if rtt is not None:
+                    PLAYER_RTT.observe(rtt)
+            case _:
+                self.logger.warning(f"Unexpected control message {status.message}")
 
-    def __merge_messages(self, new: PlayerInfo, old: PlayerInfo) -> PlayerInfo:
-        if len(old.actions) > 0:
-            # Prepend already saved actions
-            new.actions = old.actions + new.actions
-            new.action_offsets = old.action_offsets + new.action_offsets
-        return new
+    async def ping(self):
+        sequence = self.latency.next_ping(time.monotonic())
+        await self.send_control_message(GameStatus(StatusMessages.PING, str(sequence)))
 
-    def flush_last_message(self) -> PlayerInfo | None:
+    def flush_last_message(self) -> RawPlayerInfo | None:
         msg = self.last_message
         self.last_message = None
         return msg
 
-    async def flush_outgoing_buffer(self):
-        if self.queued_message is not None:
-            await self.__send_player_info(self.queued_message)
-            self.queued_message = None
-        
     def is_still_in_match(self) -> bool:
         return self.ws.client_state != WebSocketState.DISCONNECTED
 
@@ -71,4 +209,11 @@ class Player:
         await self.send_control_message(GameStatus(StatusMessages.DEFEAT))
 
     async def disconnect(self):
-        await self.ws.close()
+        await self.close_outbound()
+        await self.__close_quietly()
+
+    async def __close_quietly(self):
+        try:
+            await self.ws.close()
+        except Exception as e:
+            self.logger.debug(f"Closing an already closed connection: {e}")
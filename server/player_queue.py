@@ -0,0 +1,78 @@
+import heapq
+from collections import OrderedDict
+from typing import List, Tuple
+
+# Rebuild the expiry heap once it holds this many times more entries than queued players
+HEAP_COMPACTION_FACTOR = 4
+
+class PlayerQueue():
+    """
+    FIFO queue of waiting players.
+    Enqueue, dequeue, heartbeat and removal are O(1), expiry only touches entries whose deadline has passed.
+    """
+    def __init__(self, livetime_s: float) -> None:
+        self.livetime_s = livetime_s
+        # player id -> deadline, insertion order is queue order
+        self.deadlines: OrderedDict[str, float] = OrderedDict()
+        # (deadline, player id), may contain outdated entries which are skipped lazily
+        self.expiry_heap: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
+
+    def __contains__(self, player_id: str) -> bool:
+        return player_id in self.deadlines
+
+    def push(self, player_id: str, now: float):
+        """Append player to the end of the queue, players already queued keep their position"""
+        if player_id in self.deadlines:
+            self.touch(player_id, now)
+            return
+        deadline = now + self.livetime_s
+        self.deadlines[player_id] = deadline
+        heapq.heappush(self.expiry_heap, (deadline, player_id))
+        self.__compact_if_needed()
+
+    def touch(self, player_id: str, now: float, extra_s: float = 0.0):
+        """Heartbeat. Only the deadline is updated, the heap entry is corrected once it comes due"""
+        if player_id in self.deadlines:
+            self.deadlines[player_id] = max(self.deadlines[player_id], now + self.livetime_s + extra_s)
+
+    def remove(self, player_id: str) -> bool:
+        return self.deadlines.pop(player_id, None) is not None
+
+    def pop_pair(self) -> Tuple[str, str] | None:
+        """Dequeue the two longest waiting players"""
+        if len(self.deadlines) < 2:
+            return None
+        player_1, _ = self.deadlines.popitem(last=False)
+        player_2, _ = self.deadlines.popitem(last=False)
+        return (player_1, player_2)
+
+    def next_deadline(self) -> float | None:
+        if len(self.expiry_heap) == 0:
+            return None
+        return self.expiry_heap[0][0]
+
+    def expire(self, now: float) -> List[str]:
+        """Remove and return all players whose deadline has passed"""
+        expired = []
+        while len(self.expiry_heap) > 0 and self.expiry_heap[0][0] <= now:
+            _, player_id = heapq.heappop(self.expiry_heap)
+            deadline = self.deadlines.get(player_id)
+            # Player left or got matched in the meantime
+            if deadline is None:
+                continue
+            # Heartbeat arrived after this entry was pushed
+            if deadline > now:
+                heapq.heappush(self.expiry_heap, (deadline, player_id))
+                continue
+            del self.deadlines[player_id]
+            expired.append(player_id)
+        return expired
+
+    def __compact_if_needed(self):
+        if len(self.expiry_heap) <= HEAP_COMPACTION_FACTOR * (len(self.deadlines) + 16):
+            return
+        self.expiry_heap = [(deadline, player_id) for player_id, deadline in self.deadlines.items()]
+        heapq.heapify(self.expiry_heap)
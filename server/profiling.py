@@ -0,0 +1,178 @@
+import asyncio
+import cProfile
+import contextvars
+import logging
+import os
+import pstats
+import time
+from asyncio import events
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from server.const.settings import (
+    PROFILE_OUTPUT_DIR,
+    PROFILING_LAG_SAMPLE_INTERVAL_S,
+    PROFILING_REPORT_INTERVAL_S,
+    PROFILING_TOP_N,
+    SLOW_CALLBACK_THRESHOLD_S,
+)
+
+# Set by the match for everything running on its behalf, tasks inherit it on creation
+CURRENT_MATCH_ID: contextvars.ContextVar[str | None] = contextvars.ContextVar("current_match_id", default=None)
+
+def callback_name(callback) -> str:
+    """Coroutine name for task steps, qualified function name for plain callbacks"""
+    owner = getattr(callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        return owner.get_coro().__qualname__
+    return getattr(callback, "__qualname__", repr(callback))
+
+class SlowCallbackStats():
+    __slots__ = ("count", "total_s", "max_s")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+
+    def add(self, duration: float):
+        self.count += 1
+        self.total_s += duration
+        self.max_s = max(self.max_s, duration)
+
+class LoopProfiler():
+    """
+    Opt-in profiling of the single event loop every match shares.
+    Every callback the loop runs is timed, the ones above the threshold are aggregated per
+    (coroutine, match id) and reported periodically together with the sampled loop lag.
+    """
+    def __init__(self, threshold_s: float = SLOW_CALLBACK_THRESHOLD_S) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.threshold_s = threshold_s
+        self.slow_callbacks: Dict[Tuple[str, str | None], SlowCallbackStats] = dict()
+        self.lag_samples: Deque[float] = deque(maxlen=int(PROFILING_REPORT_INTERVAL_S / PROFILING_LAG_SAMPLE_INTERVAL_S) + 1)
+        self.window_start = time.monotonic()
+        self.tasks: List[asyncio.Task] = []
+        self.original_run = None
+        self.capture_running = False
+
+    def install(self):
+        """Patch handle execution, must be called from within the running loop"""
+        if len(self.tasks) > 0:
+            return
+        # The lag sampler works on any loop
+        self.tasks.append(asyncio.create_task(self.__sample_lag()))
+        self.tasks.append(asyncio.create_task(self.__report_loop()))
+        loop = asyncio.get_running_loop()
+        if not isinstance(loop, asyncio.BaseEventLoop):
+            # uvloop and other native loops run their handles without events.Handle._run
+            self.logger.warning(f"Running on {type(loop).__module__}.{type(loop).__qualname__}, slow callbacks can not be timed, "
+                                "only loop lag is reported. Run uvicorn with --loop asyncio to time callbacks")
+            return
+        self.original_run = events.Handle._run
+        profiler = self
+        original_run = self.original_run
+
+        def timed_run(handle):
+            start = time.perf_counter()
+            original_run(handle)
+            duration = time.perf_counter() - start
+            if duration >= profiler.threshold_s:
+                # Read after running, the step that set the match id is the one being timed
+                profiler.record_slow_callback(callback_name(handle._callback), handle._context.get(CURRENT_MATCH_ID), duration)
+
+        events.Handle._run = timed_run
+        self.logger.info(f"Profiling enabled, reporting callbacks slower than {self.threshold_s * 1000:.1f}ms")
+
+    def uninstall(self):
+        if self.original_run is not None:
+            events.Handle._run = self.original_run
+            self.original_run = None
+        for task in self.tasks:
+            task.cancel()
+        self.tasks.clear()
+
+    def record_slow_callback(self, name: str, match_id: str | None, duration: float):
+        key = (name, match_id)
+        if (stats := self.slow_callbacks.get(key)) is None:
+            stats = SlowCallbackStats()
+            self.slow_callbacks[key] = stats
+        stats.add(duration)
+
+    async def __sample_lag(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(PROFILING_LAG_SAMPLE_INTERVAL_S)
+            self.lag_samples.append(max(0.0, time.perf_counter() - start - PROFILING_LAG_SAMPLE_INTERVAL_S))
+
+    async def __report_loop(self):
+        while True:
+            await asyncio.sleep(PROFILING_REPORT_INTERVAL_S)
+            self.logger.info(self.format_report(self.report()))
+            self.reset()
+
+    def reset(self):
+        self.slow_callbacks.clear()
+        self.lag_samples.clear()
+        self.window_start = time.monotonic()
+
+    def report(self, top_n: int = PROFILING_TOP_N) -> dict:
+        """Slowest callbacks of the current window by total time, plus loop lag percentiles"""
+        ranked = sorted(self.slow_callbacks.items(), key=lambda item: item[1].total_s, reverse=True)[:top_n]
+        lag = sorted(self.lag_samples)
+        return {
+            "window_s": round(time.monotonic() - self.window_start, 1),
+            "loop_lag_ms": {
+                "samples": len(lag),
+                "p50": round(lag[len(lag) // 2] * 1000, 2) if lag else None,
+                "p99": round(lag[int(len(lag) * 0.99)] * 1000, 2) if lag else None,
+                "max": round(lag[-1] * 1000, 2) if lag else None,
+            },
+            "slow_callbacks": [
+                {
+                    "callback": name,
+                    "match_id": match_id,
+                    "count": stats.count,
+                    "total_ms": round(stats.total_s * 1000, 2),
+                    "max_ms": round(stats.max_s * 1000, 2),
+                }
+                for (name, match_id), stats in ranked
+            ],
+        }
+
+    def format_report(self, report: dict) -> str:
+        lines = [f"Loop report over {report['window_s']}s, lag ms {report['loop_lag_ms']}"]
+        for entry in report["slow_callbacks"]:
+            lines.append(f"  {entry['total_ms']:9.2f}ms total {entry['max_ms']:8.2f}ms max {entry['count']:6d}x {entry['callback']} (match {entry['match_id']})")
+        if len(report["slow_callbacks"]) == 0:
+            lines.append("  no slow callbacks")
+        return "\n".join(lines)
+
+    async def capture(self, duration_s: float) -> str:
+        """
+        Run cProfile over the event loop thread for a window of time.
+        The written file is in pstats format (snakeviz, gprof2dot, pstats.Stats).
+        """
+        if self.capture_running:
+            raise RuntimeError("A capture is already running")
+        self.capture_running = True
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            await asyncio.sleep(duration_s)
+        finally:
+            profile.disable()
+            self.capture_running = False
+        os.makedirs(PROFILE_OUTPUT_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_OUTPUT_DIR, f"loop-{time.strftime('%Y%m%d-%H%M%S')}.pstats")
+        profile.dump_stats(path)
+        self.logger.info(f"Wrote {duration_s}s profile to {path}")
+        return path
+
+    def top_functions(self, path: str, top_n: int = PROFILING_TOP_N) -> List[dict]:
+        stats = pstats.Stats(path)
+        ranked = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top_n]
+        return [
+            {"function": f"{file}:{line}({name})", "calls": calls, "cumulative_ms": round(cumulative * 1000, 2)}
+            for (file, line, name), (_, calls, _, cumulative, _) in ranked
+        ]
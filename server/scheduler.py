@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List
+
+from server.const.settings import TICK_RATE_HZ
+from server.match import Match
+from server.metrics import MATCHES_FINISHED, TICK_DURATION, TICK_OVERRUNS
+from server.profiling import CURRENT_MATCH_ID
+
+class TickScheduler():
+    """Drives every active match from a single loop instead of one task per match"""
+    def __init__(self, tick_rate_hz: float = TICK_RATE_HZ) -> None:
+        self.tick_interval = 1 / tick_rate_hz
+        self.matches: Dict[str, Match] = dict()
+        self.logger = logging.getLogger(__name__)
+        self.task: asyncio.Task | None = None
+        # Only tick while there is something to do
+        self.has_matches = asyncio.Event()
+        self.finished_listeners: List[Callable[[str], None]] = []
+
+        self.tick_count = 0
+        self.overrun_count = 0
+        self.last_tick_duration = 0.0
+        self.max_tick_duration = 0.0
+
+    def start(self):
+        if self.task is not None:
+            return
+        self.logger.info(f"Starting tick scheduler at {1 / self.tick_interval:.0f}Hz")
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    def add_finished_listener(self, listener: Callable[[str], None]):
+        """Called with the match id once a match is done, instead of owners scanning for finished matches"""
+        self.finished_listeners.append(listener)
+
+    def add_match(self, match: Match):
+        self.matches[match.id] = match
+        self.has_matches.set()
+
+    def __remove_match(self, match_id: str):
+        self.matches.pop(match_id, None)
+        if len(self.matches) == 0:
+            self.has_matches.clear()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.has_matches.wait()
+            next_tick = loop.time()
+            while len(self.matches) > 0:
+                start = loop.time()
+                await self.tick(time.monotonic())
+                duration = loop.time() - start
+                self.__record_tick(duration)
+
+                next_tick += self.tick_interval
+                # Drop missed ticks instead of trying to catch up with a burst
+                if duration > self.tick_interval:
+                    next_tick = loop.time()
+                await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    async def tick(self, now: float):
+        # Sequential, a tick only enqueues messages and never waits on a connection
+        for match in list(self.matches.values()):
+            if not match.is_due(now):
+                continue
+            # Only while this match is ticked, scheduler steps between matches stay unattributed
+            token = CURRENT_MATCH_ID.set(match.id)
+            try:
+                await match.tick(now)
+            except Exception as e:
+                self.logger.warning(f"Tick failed for match {match.id}: {e}")
+            finally:
+                CURRENT_MATCH_ID.reset(token)
+            if match.ready_to_die():
+                self.finish_match(match)
+
+    def finish_match(self, match: Match):
+        """Drop a match and tell the listeners, also used for lobbies that never filled"""
+        if match.id not in self.matches:
+            return
+        self.__remove_match(match.id)
+        MATCHES_FINISHED.inc()
+        match.on_removed()
+        for listener in self.finished_listeners:
+            listener(match.id)
+
+    def __record_tick(self, duration: float):
+        self.tick_count += 1
+        self.last_tick_duration = duration
+        self.max_tick_duration = max(self.max_tick_duration, duration)
+        TICK_DURATION.observe(duration)
+        if duration > self.tick_interval:
+            self.overrun_count += 1
+            TICK_OVERRUNS.inc()
+            self.logger.warning(f"Tick overran by {(duration - self.tick_interval) * 1000:.2f}ms ({len(self.matches)} matches)")
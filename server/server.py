@@ -1,24 +1,104 @@
+import asyncio
 import logging
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse
+import secrets
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
+from server.admission import AdmissionController, AdmissionRejected
+from server.const.settings import ADMIN_TOKEN, MAX_MATCHES_PER_SHARD, MAX_PROFILE_WINDOW_S, MAX_QUEUE_LONG_POLL_S, PROFILING_ENABLED, SERVER_ROLE, SHARD_COUNT, SHARD_INDEX
 from server.matchmaking import MatchMaker
+from server.metrics import CONTENT_TYPE, MATCHES, QUEUE_DEPTH, REGISTRY, monitor_loop_lag
+from server.profiling import LoopProfiler
+from server.scheduler import TickScheduler
+from server.sharding import ShardLoad, shard_for_match, shard_load_path, verify_match_id
 from server.types.body import JoinQueueBody
 from shared.const.queue_status import QueueStatus
 from shared.utils.validation import is_valid_uuid
 
 LOGGER = logging.getLogger(__name__)
 
-matchMaker = MatchMaker()
+scheduler = TickScheduler()
+if SERVER_ROLE == "standalone":
+    matchMaker = MatchMaker(scheduler)
+else:
+    matchMaker = MatchMaker(scheduler, max_matches=MAX_MATCHES_PER_SHARD, shard_load=ShardLoad(shard_load_path(), SHARD_COUNT))
+profiler = LoopProfiler() if PROFILING_ENABLED else None
+admission = AdmissionController()
 
-app = FastAPI()
+QUEUE_DEPTH.callback = lambda: len(matchMaker.queue)
+MATCHES.callback = matchMaker.matches_by_state
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scheduler.start()
+    matchMaker.start_reaper()
+    loop_lag_task = asyncio.create_task(monitor_loop_lag())
+    if profiler is not None:
+        profiler.install()
+    yield
+    loop_lag_task.cancel()
+    if profiler is not None:
+        profiler.uninstall()
+    await matchMaker.stop_reaper()
+    await scheduler.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.get("/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+def require_profiler(token: str) -> LoopProfiler:
+    # Pretend the routes do not exist unless profiling and an admin token are configured
+    if profiler is None or ADMIN_TOKEN == "":
+        raise HTTPException(status_code=404)
+    if not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    return profiler
+
+@app.get("/admin/profile/report")
+async def get_profile_report(x_admin_token: str = Header(default="")):
+    return require_profiler(x_admin_token).report()
+
+@app.post("/admin/profile")
+async def capture_profile(seconds: float = 10.0, x_admin_token: str = Header(default="")):
+    """cProfile the event loop for the given window, answers once the profile is written"""
+    active_profiler = require_profiler(x_admin_token)
+    if active_profiler.capture_running:
+        raise HTTPException(status_code=409, detail="A capture is already running")
+    path = await active_profiler.capture(min(max(seconds, 0.1), MAX_PROFILE_WINDOW_S))
+    return {"path": path, "top": active_profiler.top_functions(path)}
+
+def admission_key(request: Request, player_id: str) -> str:
+    """Rate limit bucket of a join"""
+    # uvicorn already replaced the peer with the X-Forwarded-For client if the proxy is in FORWARDED_ALLOW_IPS
+    if request.client is not None and request.client.host:
+        return request.client.host
+    # No peer address (e.g. unix socket), a bucket per player instead of one shared by everybody
+    return f"player:{player_id}"
 
 @app.post("/queue", status_code=201)
-async def new_queue(new_player: JoinQueueBody):
+async def new_queue(new_player: JoinQueueBody, request: Request):
     if not is_valid_uuid(new_player.player_id): 
         raise HTTPException(
             status_code=400,
             detail=f"Provided player id was invalid (Gave: {new_player.player_id} Wants: valid uuid)"
         )
+    try:
+        admission.check_join(
+            admission_key(request, new_player.player_id),
+            already_queued=new_player.player_id in matchMaker.queue,
+            queue_size=len(matchMaker.queue),
+            active_matches=matchMaker.active_match_count(),
+            now=time.monotonic(),
+        )
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Server is busy ({e.reason}), try again later",
+            headers={"Retry-After": e.retry_after_header()},
+        )
     matchMaker.add_player(new_player.player_id)
 
 @app.delete("/queue/{player_id}")
@@ -31,20 +111,28 @@ async def remove_player_from_queue(player_id: str):
     matchMaker.remove_player(player_id)
 
 @app.get("/queue/{player_id}")
-async def get_queue_status(player_id: str):
+async def get_queue_status(player_id: str, wait: float = 0.0):
+    """With wait > 0 this long polls: it answers as soon as the player leaves the queue or after wait seconds"""
     if not is_valid_uuid(player_id): 
         raise HTTPException(
             status_code=400,
             detail="Provided player id was invalid"
         )
+    if wait > 0:
+        await matchMaker.wait_for_status_change(player_id, min(wait, MAX_QUEUE_LONG_POLL_S))
     status, match_id = matchMaker.get_player_status(player_id)
     if status in [QueueStatus.MATCHED, QueueStatus.IN_GAME]:
         return JSONResponse(content={"status": status.value, "match_id": match_id}, status_code=200)
     return JSONResponse(content={"status": status.value}, status_code=200)
 
+def is_valid_match_id(match_id: str) -> bool:
+    if SERVER_ROLE == "shard":
+        return verify_match_id(match_id) and shard_for_match(match_id, SHARD_COUNT) == SHARD_INDEX
+    return matchMaker.is_valid_match_id(match_id)
+
 @app.websocket("/match/{match_id}/{player_id}/{player_name}")
 async def websocket_endpoint(websocket: WebSocket, match_id: str, player_id: str, player_name: str):
-    if not matchMaker.is_valid_match_id(match_id):
+    if not is_valid_match_id(match_id):
         LOGGER.info(f"Client connected with invalid match id {match_id}")
         await websocket.close()
         return
@@ -53,9 +141,15 @@ async def websocket_endpoint(websocket: WebSocket, match_id: str, player_id: str
         await websocket.close()
         return
     await websocket.accept()
+    # The coordinator only places matches on shards with room, this catches the rare race
+    if SERVER_ROLE == "shard" and matchMaker.get_match(match_id) is None and not matchMaker.has_match_capacity():
+        LOGGER.warning(f"Refused match {match_id}, shard is at capacity")
+        admission.reject_match()
+        await websocket.close(code=1013, reason="Try again later")
+        return
     LOGGER.info("New client connected")
     try:
-        match = matchMaker.get_match(match_id)
+        match = matchMaker.adopt_match(match_id) if SERVER_ROLE == "shard" else matchMaker.get_match(match_id)
         await match.accept_player(player_id, player_name, websocket)
         await websocket.close()
     except WebSocketDisconnect:
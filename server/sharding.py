@@ -0,0 +1,301 @@
+import array
+import asyncio
+import hashlib
+import hmac
+import logging
+import mmap
+import os
+import secrets
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+import uuid
+import zlib
+from collections import deque
+from typing import Deque, List, Set, Tuple
+
+import uvicorn
+
+from server.const.settings import MATCH_TICKET_TTL_S, SHARD_SECRET, SHARD_SOCKET_DIR, TICKET_CONNECT_GRACE_S, UVICORN_LOOP
+
+LOGGER = logging.getLogger(__name__)
+
+# The request line has to fit, the rest of the head stays in the socket for the worker
+MAX_REQUEST_LINE_BYTES = 8 * 1024
+REQUEST_LINE_TIMEOUT_S = 5.0
+# Peeking does not consume, so the socket stays readable until the rest of the line arrived
+PEEK_RETRY_S = 0.005
+# A worker that cannot take a connection for this long gets the connection dropped
+HANDOFF_TIMEOUT_S = 1.0
+HANDOFF_RETRY_S = 0.001
+MAX_FDS_PER_MESSAGE = 16
+LOAD_SLOT = struct.Struct("<q")
+
+def shard_for_match(match_id: str, shard_count: int) -> int:
+    return zlib.crc32(match_id.encode()) % shard_count
+
+def sign_match_id(raw_id: str, secret: str = SHARD_SECRET) -> str:
+    """Append a signature so shards can trust match ids without asking the coordinator"""
+    signature = hmac.new(secret.encode(), raw_id.encode(), hashlib.sha256).hexdigest()[:16]
+    return f"{raw_id}.{signature}"
+
+def verify_match_id(match_id: str, secret: str = SHARD_SECRET) -> bool:
+    raw_id, _, _ = match_id.partition(".")
+    return hmac.compare_digest(sign_match_id(raw_id, secret), match_id)
+
+def coordinator_socket_path() -> str:
+    return os.path.join(SHARD_SOCKET_DIR, "coordinator.sock")
+
+def shard_socket_path(shard_index: int) -> str:
+    return os.path.join(SHARD_SOCKET_DIR, f"shard-{shard_index}.sock")
+
+def shard_load_path() -> str:
+    return os.path.join(SHARD_SOCKET_DIR, "load")
+
+class ShardLoad():
+    """
+    Live match count of every shard in a small file all workers map.
+    Each shard only writes its own slot, the coordinator reads all of them.
+    """
+    def __init__(self, path: str, shard_count: int) -> None:
+        self.shard_count = shard_count
+        with open(path, "r+b") as file:
+            self.map = mmap.mmap(file.fileno(), LOAD_SLOT.size * shard_count)
+
+    @staticmethod
+    def create(path: str, shard_count: int):
+        with open(path, "wb") as file:
+            file.write(bytes(LOAD_SLOT.size * shard_count))
+
+    def publish(self, shard_index: int, match_count: int):
+        LOAD_SLOT.pack_into(self.map, LOAD_SLOT.size * shard_index, match_count)
+
+    def counts(self) -> List[int]:
+        return [LOAD_SLOT.unpack_from(self.map, LOAD_SLOT.size * index)[0] for index in range(self.shard_count)]
+
+class ShardBalancer():
+    """
+    Coordinator side view of shard capacity: the live matches each shard published plus the tickets
+    that were just sent there, whose players may not have connected yet.
+    """
+    def __init__(self, load: ShardLoad, max_matches_per_shard: int) -> None:
+        self.load = load
+        self.max_matches_per_shard = max_matches_per_shard
+        # (created at, shard index), oldest first
+        self.pending: Deque[Tuple[float, int]] = deque()
+
+    def matches_per_shard(self, now: float) -> List[int]:
+        while len(self.pending) > 0 and now - self.pending[0][0] > TICKET_CONNECT_GRACE_S:
+            self.pending.popleft()
+        counts = self.load.counts()
+        for _, shard_index in self.pending:
+            counts[shard_index] += 1
+        return counts
+
+    def active_match_count(self, now: float) -> int:
+        return sum(self.matches_per_shard(now))
+
+    def pick_shard(self, now: float) -> int | None:
+        """Least loaded shard with room, None while all of them are full"""
+        counts = self.matches_per_shard(now)
+        shard_index = min(range(len(counts)), key=counts.__getitem__)
+        return shard_index if counts[shard_index] < self.max_matches_per_shard else None
+
+    def reserve(self, shard_index: int, now: float):
+        self.pending.append((now, shard_index))
+
+class MatchTicket():
+    """Coordinator side stand-in for a match that lives in a shard process"""
+    lobby_ready = False
+    player_1_slot = None
+    player_2_slot = None
+
+    def __init__(self, shard_index: int, shard_count: int) -> None:
+        # Ids decide the shard, draw until one lands on the shard that has room
+        while shard_for_match(match_id := sign_match_id(str(uuid.uuid4())), shard_count) != shard_index:
+            pass
+        self.id = match_id
+        self.shard_index = shard_index
+        self.created_at = time.monotonic()
+        self.terminated = False
+
+    async def terminate(self):
+        # The shard notices the missing player on its own
+        self.terminated = True
+
+    def ready_to_die(self) -> bool:
+        return self.terminated or time.monotonic() - self.created_at > MATCH_TICKET_TTL_S
+
+class ShardRouter():
+    """
+    Accepts all client connections and hands each one to the process owning it.
+    /match/{match_id}/... goes to the shard derived from the match id, everything else to the coordinator.
+    Only the request line is peeked, the socket itself is passed on (SCM_RIGHTS), so no traffic goes through the router.
+    """
+    def __init__(self, shard_count: int) -> None:
+        self.shard_count = shard_count
+        self.logger = logging.getLogger(__name__)
+        self.control = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.control.setblocking(False)
+        self.handoff_tasks: Set[asyncio.Task] = set()
+
+    def upstream_for_path(self, path: str) -> str:
+        parts = path.split("/")
+        if len(parts) > 2 and parts[1] == "match":
+            return shard_socket_path(shard_for_match(parts[2], self.shard_count))
+        return coordinator_socket_path()
+
+    async def handle_client(self, conn: socket.socket):
+        try:
+            path = await self.__peek_path(conn)
+            await self.__hand_over(conn, self.upstream_for_path(path))
+        except Exception as e:
+            self.logger.warning(f"Could not route connection: {e}")
+            try:
+                conn.send(b"HTTP/1.1 502 Bad Gateway\r\ncontent-length: 0\r\nconnection: close\r\n\r\n")
+            except OSError:
+                pass
+        finally:
+            # The worker has its own copy of the connection by now
+            conn.close()
+
+    async def __peek_path(self, conn: socket.socket) -> str:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + REQUEST_LINE_TIMEOUT_S
+        while True:
+            async with asyncio.timeout_at(deadline):
+                await self.__wait_readable(conn)
+            data = conn.recv(MAX_REQUEST_LINE_BYTES, socket.MSG_PEEK)
+            if len(data) == 0:
+                raise ConnectionError("Client closed before sending a request")
+            if b"\r\n" in data:
+                _, path, _ = data.split(b"\r\n", 1)[0].decode("latin-1").split(" ", 2)
+                return path
+            if len(data) >= MAX_REQUEST_LINE_BYTES:
+                raise ValueError("Request line too long")
+            await asyncio.sleep(PEEK_RETRY_S)
+
+    async def __wait_readable(self, conn: socket.socket):
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(conn.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(conn.fileno())
+
+    async def __hand_over(self, conn: socket.socket, worker_path: str):
+        deadline = time.monotonic() + HANDOFF_TIMEOUT_S
+        while True:
+            try:
+                # socket.send_fds ignores its address argument
+                self.control.sendmsg([b"\0"], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", [conn.fileno()]))], 0, worker_path)
+                return
+            except BlockingIOError:
+                # The worker has not picked up the previous connections yet
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(HANDOFF_RETRY_S)
+
+    async def serve(self, host: str, port: int):
+        loop = asyncio.get_running_loop()
+        listener = socket.create_server((host, port), backlog=2048)
+        listener.setblocking(False)
+        self.logger.info(f"Routing {host}:{port} to {self.shard_count} shards")
+        with listener:
+            while True:
+                conn, _ = await loop.sock_accept(listener)
+                task = asyncio.create_task(self.handle_client(conn))
+                self.handoff_tasks.add(task)
+                task.add_done_callback(self.handoff_tasks.discard)
+
+class HandoffServer(uvicorn.Server):
+    """Uvicorn worker that serves the connections the router hands over instead of accepting its own"""
+    def __init__(self, config: uvicorn.Config, control_path: str) -> None:
+        super().__init__(config)
+        self.control_path = control_path
+        self.control: socket.socket | None = None
+        self.connect_tasks: Set[asyncio.Task] = set()
+
+    async def startup(self, sockets=None):
+        # No listening sockets of its own, lifespan and server state are set up as usual
+        await super().startup(sockets=[])
+        if not self.started:
+            return
+        if os.path.exists(self.control_path):
+            os.remove(self.control_path)
+        self.control = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.control.bind(self.control_path)
+        self.control.setblocking(False)
+        asyncio.get_running_loop().add_reader(self.control.fileno(), self.__receive_connections)
+
+    def __create_protocol(self):
+        # Same protocol uvicorn creates for connections it accepted itself
+        return self.config.http_protocol_class(config=self.config, server_state=self.server_state, app_state=self.lifespan.state)
+
+    def __receive_connections(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                _, fds, _, _ = socket.recv_fds(self.control, 1, MAX_FDS_PER_MESSAGE)
+            except BlockingIOError:
+                return
+            for fd in fds:
+                conn = socket.socket(fileno=fd)
+                conn.setblocking(False)
+                task = loop.create_task(loop.connect_accepted_socket(self.__create_protocol, conn))
+                self.connect_tasks.add(task)
+                task.add_done_callback(self.connect_tasks.discard)
+
+    async def shutdown(self, sockets=None):
+        if self.control is not None:
+            asyncio.get_running_loop().remove_reader(self.control.fileno())
+            self.control.close()
+            self.control = None
+        await super().shutdown(sockets=sockets)
+
+def run_worker(control_path: str):
+    """Entry point of the coordinator and shard processes"""
+    config = uvicorn.Config("server.server:app", log_level="warning", loop=UVICORN_LOOP)
+    HandoffServer(config, control_path).run()
+
+def __spawn_worker(role: str, socket_path: str, shard_index: int, secret: str) -> subprocess.Popen:
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    env = dict(os.environ, SERVER_ROLE=role, SHARD_INDEX=str(shard_index), SHARD_SECRET=secret)
+    return subprocess.Popen(
+        [sys.executable, "-c", f"from server.sharding import run_worker; run_worker({socket_path!r})"],
+        env=env,
+    )
+
+def __wait_for_sockets(paths, timeout_s=10.0):
+    deadline = time.monotonic() + timeout_s
+    while not all(os.path.exists(path) for path in paths):
+        if time.monotonic() > deadline:
+            LOGGER.warning("Not all workers came up in time, routing anyway")
+            return
+        time.sleep(0.1)
+
+def run_sharded(host: str, port: int, shard_count: int):
+    """Run the coordinator and shard workers as child processes and route traffic to them"""
+    os.makedirs(SHARD_SOCKET_DIR, exist_ok=True)
+    # Shared by all children for match id signatures
+    secret = SHARD_SECRET or secrets.token_hex(16)
+    ShardLoad.create(shard_load_path(), shard_count)
+    workers = [__spawn_worker("coordinator", coordinator_socket_path(), 0, secret)]
+    for shard_index in range(shard_count):
+        workers.append(__spawn_worker("shard", shard_socket_path(shard_index), shard_index, secret))
+    __wait_for_sockets([coordinator_socket_path()] + [shard_socket_path(i) for i in range(shard_count)])
+    LOGGER.info(f"Started coordinator and {shard_count} shard workers")
+    try:
+        asyncio.run(ShardRouter(shard_count).serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.send_signal(signal.SIGTERM)
+        for worker in workers:
+            worker.wait()
@@ -28,6 +28,11 @@ setup(
                 'map.json',
                 '*.png'
             ],
+            # Local bakes from scripts/bake_models.py, build_apps converts the eggs to bam on its own
+            'exclude_patterns': [
+                'assets/models/*.bam',
+                'assets/models/bam_manifest.json',
+            ],
             # Include the OpenGL renderer and OpenAL audio plug-in
             'plugins': [
                 'pandagl',
@@ -0,0 +1,278 @@
+import math
+import struct
+from typing import Dict, List, Tuple
+
+from shared.types.player_info import ACTION_LOOKUP, PlayerInfo, RawPlayerInfo, Vector
+
+# Delta packets start with a byte a full PlayerInfo never starts with (its first byte is a 0/1 flag)
+DELTA_MAGIC = 0xDE
+FLAG_KEYFRAME = 0x01
+
+# Bits of the field mask, fields follow the header in this order
+FIELD_POSITION = 0x01
+FIELD_MOVEMENT = 0x02
+FIELD_LOOK_ROTATION = 0x04
+FIELD_BODY_ROTATION = 0x08
+FIELD_HEALTH = 0x10
+FIELD_ENEMY_HEALTH = 0x20
+FIELD_ACTIONS = 0x40
+FIELD_MATCH_TIME = 0x80
+STATE_FIELDS = FIELD_POSITION | FIELD_MOVEMENT | FIELD_LOOK_ROTATION | FIELD_BODY_ROTATION | FIELD_HEALTH | FIELD_ENEMY_HEALTH
+
+# magic, flags, sequence, baseline sequence, field mask
+DELTA_HEADER_STRUCT = struct.Struct("<BBHHB")
+# Positions in mm, movement in cm/s, rotations as 16 bit angles
+POSITION_STRUCT = struct.Struct("<3i")
+MOVEMENT_STRUCT = struct.Struct("<3h")
+ANGLE_STRUCT = struct.Struct("<H")
+HEALTH_STRUCT = struct.Struct("<h")
+ACTION_COUNT_STRUCT = struct.Struct("<B")
+OFFSET_STRUCT = struct.Struct("<f")
+MATCH_TIME_STRUCT = struct.Struct("<f")
+
+POSITION_SCALE = 1000
+MOVEMENT_SCALE = 100
+ANGLE_STEPS = 1 << 16
+
+# Fixed size fields in wire order, actions are variable and always last
+FIELD_LAYOUT: Tuple[Tuple[int, struct.Struct], ...] = (
+    (FIELD_POSITION, POSITION_STRUCT),
+    (FIELD_MOVEMENT, MOVEMENT_STRUCT),
+    (FIELD_LOOK_ROTATION, ANGLE_STRUCT),
+    (FIELD_BODY_ROTATION, ANGLE_STRUCT),
+    (FIELD_HEALTH, HEALTH_STRUCT),
+    (FIELD_ENEMY_HEALTH, HEALTH_STRUCT),
+    # Not part of the state, sent along with every packet that changes it
+    (FIELD_MATCH_TIME, MATCH_TIME_STRUCT),
+)
+
+SEQUENCE_MODULO = 1 << 16
+
+def is_delta_packet(data: bytes) -> bool:
+    return len(data) > 0 and data[0] == DELTA_MAGIC
+
+def quantize_position(vec: Vector) -> Tuple[int, int, int]:
+    return (round(vec.x * POSITION_SCALE), round(vec.y * POSITION_SCALE), round(vec.z * POSITION_SCALE))
+
+def quantize_movement(vec: Vector) -> Tuple[int, int, int]:
+    return tuple(max(-32767, min(32767, round(val * MOVEMENT_SCALE))) for val in (vec.x, vec.y, vec.z))
+
+def quantize_angle(degrees: float) -> int:
+    return round((degrees % 360.0) * ANGLE_STEPS / 360.0) % ANGLE_STEPS
+
+def dequantize_angle(value: int) -> float:
+    degrees = value * 360.0 / ANGLE_STEPS
+    # Keep pitch values in the usual -180..180 range
+    return degrees - 360.0 if degrees > 180.0 else degrees
+
+def quantize_health(value: int) -> int:
+    return max(-32768, min(32767, int(value)))
+
+def fields_size(mask: int) -> int:
+    return sum(layout.size for bit, layout in FIELD_LAYOUT if mask & bit)
+
+def actions_size(data: bytes, offset: int) -> int:
+    count = ACTION_COUNT_STRUCT.unpack_from(data, offset)[0]
+    return ACTION_COUNT_STRUCT.size + count + OFFSET_STRUCT.size * count
+
+def peek_delta(data: bytes, health: int) -> RawPlayerInfo:
+    """
+    Relay info of a delta packet without decoding it, raises ValueError on malformed framing.
+    Delta packets only carry health when it changed, the last known value has to be passed in.
+    """
+    if len(data) < DELTA_HEADER_STRUCT.size:
+        raise ValueError("Payload shorter than delta header")
+    magic, _, _, _, mask = DELTA_HEADER_STRUCT.unpack_from(data)
+    if magic != DELTA_MAGIC:
+        raise ValueError("Not a delta packet")
+    offset = DELTA_HEADER_STRUCT.size
+    for bit, layout in FIELD_LAYOUT:
+        if not mask & bit:
+            continue
+        if bit == FIELD_HEALTH and len(data) >= offset + layout.size:
+            health = layout.unpack_from(data, offset)[0]
+        offset += layout.size
+    actions_offset = offset
+    action_count = 0
+    if mask & FIELD_ACTIONS:
+        if len(data) <= offset:
+            raise ValueError("Payload truncated before actions")
+        action_count = data[offset]
+        offset += actions_size(data, offset)
+    if len(data) != offset:
+        raise ValueError("Payload length does not match field mask")
+    return RawPlayerInfo(data, health, actions_offset, action_count)
+
+def merge_delta(old: RawPlayerInfo, new: RawPlayerInfo) -> RawPlayerInfo:
+    """
+    Combine two deltas of the same sender that were not relayed yet.
+    Fields of new win, fields only present in old are kept and actions are concatenated,
+    so the result still applies on top of the baseline of old.
+    """
+    _, old_flags, _, baseline, old_mask = DELTA_HEADER_STRUCT.unpack_from(old.data)
+    _, new_flags, sequence, _, new_mask = DELTA_HEADER_STRUCT.unpack_from(new.data)
+    old_view = memoryview(old.data)
+    new_view = memoryview(new.data)
+    old_offset = new_offset = DELTA_HEADER_STRUCT.size
+    parts = [b""]
+    for bit, layout in FIELD_LAYOUT:
+        if new_mask & bit:
+            parts.append(new_view[new_offset:new_offset + layout.size])
+        elif old_mask & bit:
+            parts.append(old_view[old_offset:old_offset + layout.size])
+        old_offset += layout.size if old_mask & bit else 0
+        new_offset += layout.size if new_mask & bit else 0
+    mask = old_mask | new_mask
+    action_count = old.action_count + new.action_count
+    actions_offset = DELTA_HEADER_STRUCT.size + fields_size(mask)
+    if action_count > 255:
+        # Cannot happen at our send rates, drop the oldest actions rather than the packet
+        action_count = new.action_count
+    if action_count > 0:
+        old_count = action_count - new.action_count
+        old_actions = old_view[old_offset + ACTION_COUNT_STRUCT.size:old_offset + ACTION_COUNT_STRUCT.size + old_count] if old_count else b""
+        new_actions = new_view[new_offset + ACTION_COUNT_STRUCT.size:new_offset + ACTION_COUNT_STRUCT.size + new.action_count] if new.action_count else b""
+        old_offsets = old_view[old_offset + ACTION_COUNT_STRUCT.size + old_count:] if old_count else b""
+        new_offsets = new_view[new_offset + ACTION_COUNT_STRUCT.size + new.action_count:] if new.action_count else b""
+        parts += (ACTION_COUNT_STRUCT.pack(action_count), old_actions, new_actions, old_offsets, new_offsets)
+    else:
+        mask &= ~FIELD_ACTIONS
+    # Either being a keyframe means the merged mask covers every state field
+    parts[0] = DELTA_HEADER_STRUCT.pack(DELTA_MAGIC, old_flags | new_flags, sequence, baseline, mask)
+    return RawPlayerInfo(b"".join(parts), new.health, actions_offset, action_count)
+
+class DeltaEncoder:
+    """
+    Encodes PlayerInfo as the difference to the previously sent packet.
+    The websocket is reliable and ordered and the server merges instead of dropping,
+    so every sent packet becomes the baseline of the next one. Keyframes resync the receiver regardless.
+    """
+    def __init__(self, keyframe_interval_s: float) -> None:
+        self.keyframe_interval_s = keyframe_interval_s
+        self.sequence = 0
+        self.last_keyframe_time: float | None = None
+        # Quantized field values as last sent
+        self.baseline: Dict[int, tuple] = dict()
+
+    def reset(self):
+        self.sequence = 0
+        self.last_keyframe_time = None
+        self.baseline.clear()
+
+    def __quantize(self, info: PlayerInfo) -> Dict[int, tuple]:
+        # Unset fields (e.g. priority packets only carrying actions) are unchanged, not cleared
+        values = {
+            FIELD_HEALTH: (quantize_health(info.health),),
+            FIELD_ENEMY_HEALTH: (quantize_health(info.enemy_health),),
+        }
+        if info.position is not None:
+            values[FIELD_POSITION] = quantize_position(info.position)
+        if info.movement is not None:
+            values[FIELD_MOVEMENT] = quantize_movement(info.movement)
+        if info.lookRotation is not None:
+            values[FIELD_LOOK_ROTATION] = (quantize_angle(info.lookRotation),)
+        if info.bodyRotation is not None:
+            values[FIELD_BODY_ROTATION] = (quantize_angle(info.bodyRotation),)
+        return values
+
+    def encode(self, info: PlayerInfo, now: float) -> bytes | None:
+        """Encoded delta, None if nothing changed since the last packet and no keyframe is due"""
+        values = self.__quantize(info)
+        is_keyframe = False
+        if self.last_keyframe_time is None or now - self.last_keyframe_time >= self.keyframe_interval_s:
+            # A keyframe needs every field, the ones this packet did not set come from the baseline
+            complete = {**self.baseline, **values}
+            is_keyframe = all(bit in complete for bit, _ in FIELD_LAYOUT if bit & STATE_FIELDS)
+            if is_keyframe:
+                values = complete
+        mask = STATE_FIELDS if is_keyframe else 0
+        if not is_keyframe:
+            for bit, value in values.items():
+                if self.baseline.get(bit) != value:
+                    mask |= bit
+        if info.actions:
+            mask |= FIELD_ACTIONS
+        if mask == 0:
+            return None
+        if info.match_time is not None:
+            mask |= FIELD_MATCH_TIME
+
+        baseline_sequence = self.sequence
+        self.sequence = (self.sequence + 1) % SEQUENCE_MODULO or 1
+        parts = [DELTA_HEADER_STRUCT.pack(DELTA_MAGIC, FLAG_KEYFRAME if is_keyframe else 0, self.sequence, baseline_sequence, mask)]
+        for bit, layout in FIELD_LAYOUT:
+            if bit == FIELD_MATCH_TIME and mask & bit:
+                parts.append(layout.pack(info.match_time))
+            elif mask & bit:
+                parts.append(layout.pack(*values[bit]))
+        if info.actions:
+            actions = info.actions[-255:]
+            offsets = info.action_offsets[-255:]
+            parts.append(ACTION_COUNT_STRUCT.pack(len(actions)))
+            parts.append(bytes([action.value for action in actions]))
+            parts.append(struct.pack(f"<{len(offsets)}f", *offsets))
+        self.baseline.update(values)
+        if is_keyframe:
+            self.last_keyframe_time = now
+        return b"".join(parts)
+
+class DeltaDecoder:
+    """Applies received deltas on top of the last known state of the sender"""
+    def __init__(self) -> None:
+        self.sequence = 0
+        self.in_sync = False
+        self.health = 1
+        self.enemy_health = 1
+
+    def decode(self, data: bytes) -> PlayerInfo:
+        """
+        PlayerInfo with the fields contained in the delta set, health is always filled from the known state.
+        Raises ValueError on malformed packets.
+        """
+        magic, flags, sequence, baseline, mask = DELTA_HEADER_STRUCT.unpack_from(data)
+        if magic != DELTA_MAGIC:
+            raise ValueError("Not a delta packet")
+        # Fields always carry absolute values, a missed baseline only means unchanged fields may be stale until the next keyframe
+        self.in_sync = bool(flags & FLAG_KEYFRAME) or (self.in_sync and baseline == self.sequence)
+        self.sequence = sequence
+        offset = DELTA_HEADER_STRUCT.size
+        info = PlayerInfo()
+        if mask & FIELD_POSITION:
+            x, y, z = POSITION_STRUCT.unpack_from(data, offset)
+            offset += POSITION_STRUCT.size
+            info.position = Vector(x / POSITION_SCALE, y / POSITION_SCALE, z / POSITION_SCALE, 1)
+        if mask & FIELD_MOVEMENT:
+            x, y, z = MOVEMENT_STRUCT.unpack_from(data, offset)
+            offset += MOVEMENT_STRUCT.size
+            x, y, z = x / MOVEMENT_SCALE, y / MOVEMENT_SCALE, z / MOVEMENT_SCALE
+            info.movement = Vector(x, y, z, math.sqrt(x * x + y * y + z * z))
+        if mask & FIELD_LOOK_ROTATION:
+            info.lookRotation = dequantize_angle(ANGLE_STRUCT.unpack_from(data, offset)[0])
+            offset += ANGLE_STRUCT.size
+        if mask & FIELD_BODY_ROTATION:
+            info.bodyRotation = dequantize_angle(ANGLE_STRUCT.unpack_from(data, offset)[0])
+            offset += ANGLE_STRUCT.size
+        if mask & FIELD_HEALTH:
+            self.health = HEALTH_STRUCT.unpack_from(data, offset)[0]
+            offset += HEALTH_STRUCT.size
+        if mask & FIELD_ENEMY_HEALTH:
+            self.enemy_health = HEALTH_STRUCT.unpack_from(data, offset)[0]
+            offset += HEALTH_STRUCT.size
+        info.health = self.health
+        info.enemy_health = self.enemy_health
+        if mask & FIELD_MATCH_TIME:
+            info.match_time = MATCH_TIME_STRUCT.unpack_from(data, offset)[0]
+            offset += MATCH_TIME_STRUCT.size
+        if mask & FIELD_ACTIONS:
+            count = ACTION_COUNT_STRUCT.unpack_from(data, offset)[0]
+            offset += ACTION_COUNT_STRUCT.size
+            actions: List = [ACTION_LOOKUP[value] for value in data[offset:offset + count]]
+            if None in actions or len(actions) != count:
+                raise ValueError("Unknown action in payload")
+            offset += count
+            info.actions = actions
+            info.action_offsets = list(struct.unpack_from(f"<{count}f", data, offset))
+            offset += OFFSET_STRUCT.size * count
+        if offset != len(data):
+            raise ValueError("Payload length does not match field mask")
+        return info
@@ -1,7 +1,7 @@
 from dataclasses import dataclass, field
 from enum import Enum
 import struct
-from typing import List
+from typing import Dict, List, NamedTuple, Tuple
 
 
 class PlayerAction(Enum):
@@ -14,7 +14,36 @@ class PlayerAction(Enum):
     DEAL_DAMAGE = 7
     GOT_BLOCKED = 8
 
-@dataclass
+# Precompiled layouts, keep in sync with the wire format.
+# Presence flags, health, and rotation values. Spelled out with explicit padding ("=" disables alignment)
+# so it can be concatenated with the variable part into one struct per packet shape.
+HEADER_FORMAT = "B3xiiB3xfB3xfB"
+HEADER_STRUCT = struct.Struct("=" + HEADER_FORMAT)
+VECTOR_STRUCT = struct.Struct("=4f")
+LENGTH_STRUCT = struct.Struct("=I")
+# Optional trailer, decoders that do not know it ignore trailing bytes
+MATCH_TIME_STRUCT = struct.Struct("=f")
+# Position flag, health and movement flag only, used by the server to relay packets without decoding them
+PEEK_STRUCT = struct.Struct("=B3xi20xB")
+
+# Index = wire value, lets actions be decoded without calling the enum constructor
+ACTION_LOOKUP = tuple(PlayerAction._value2member_map_.get(i) for i in range(256))
+
+_packet_structs: Dict[Tuple[bool, bool, int], struct.Struct] = dict()
+
+def packet_struct(has_position: bool, has_movement: bool, action_count: int) -> struct.Struct:
+    """Complete packet layout for one shape, compiled once and cached"""
+    key = (has_position, has_movement, action_count)
+    if (compiled := _packet_structs.get(key)) is None:
+        fmt = "=" + HEADER_FORMAT
+        fmt += "4f" if has_position else ""
+        fmt += "4f" if has_movement else ""
+        fmt += f"I{action_count}sI{action_count}f" if action_count else "II"
+        compiled = struct.Struct(fmt)
+        _packet_structs[key] = compiled
+    return compiled
+
+@dataclass(slots=True)
 class Vector:
     x: float 
     y: float
@@ -22,17 +51,16 @@ class Vector:
     length : float
 
     def to_bytes(self) -> bytes:
-        return struct.pack("ffff", self.x, self.y, self.z, self.length)
+        return VECTOR_STRUCT.pack(self.x, self.y, self.z, self.length)
 
     @staticmethod
     def from_bytes(data: bytes):
-        x, y, z, length = struct.unpack("ffff", data)
-        return Vector(x, y, z, length)
+        return Vector(*VECTOR_STRUCT.unpack(data))
 
     def __hash__(self) -> int:
         return int(self.x + self.y + self.z + self.length)
 
-@dataclass
+@dataclass(slots=True)
 class PlayerInfo:
     position: Vector | None = None
     health: int = 1 # this cannot default to 0 as 0 means defeat :)
@@ -42,6 +70,8 @@ class PlayerInfo:
     movement: Vector | None = None
     actions: List[PlayerAction] = field(default_factory=lambda: [])
     action_offsets: List[float] = field(default_factory=lambda: [])
+    # Sender match timer when the snapshot was taken, used to interpolate remote movement
+    match_time: float | None = None
 
     def __post_init__(self):
         if isinstance(self.position, dict):
@@ -50,67 +80,73 @@ class PlayerInfo:
             self.movement = Vector(**self.movement)
         assert len(self.actions) == len(self.action_offsets)
 
-    def to_bytes(self) -> bytes:
-        parts = []
-        
-        # Pack fixed fields
-        fmt = "B i i B f B f B"  # Presence flags, health, and rotation values
-        parts.append(struct.pack(fmt, 
-            1 if self.position else 0,
+    def __pack_args(self) -> Tuple[struct.Struct, tuple]:
+        """Packet layout and the values to pack into it"""
+        look = self.lookRotation
+        body = self.bodyRotation
+        position = self.position
+        movement = self.movement
+        actions = self.actions
+        key = (position is not None, movement is not None, len(actions))
+        packer = _packet_structs.get(key) or packet_struct(*key)
+        args = (
+            1 if position else 0,
             self.health,
             self.enemy_health,
-            1 if self.lookRotation is not None else 0,
-            self.lookRotation if self.lookRotation is not None else 0.0,
-            1 if self.bodyRotation is not None else 0,
-            self.bodyRotation if self.bodyRotation is not None else 0.0,
-            1 if self.movement else 0
-        ))
-
-        # Serialize optional vectors
-        if self.position:
-            parts.append(self.position.to_bytes())
-        if self.movement:
-            parts.append(self.movement.to_bytes())
-
-        # Serialize actions as integers with length prefix
-        parts.append(struct.pack("I", len(self.actions)))  # 4-byte length prefix
-        for action in self.actions:
-            parts.append(struct.pack("B", action.value))  # Each action as 1 byte
-
-        # Serialize action_offsets as floats with length prefix
-        parts.append(struct.pack("I", len(self.action_offsets)))  # 4-byte length prefix
-        if self.action_offsets:
-            parts.append(struct.pack(f"{len(self.action_offsets)}f", *self.action_offsets))
-
-        return b"".join(parts)
+            0 if look is None else 1,
+            0.0 if look is None else look,
+            0 if body is None else 1,
+            0.0 if body is None else body,
+            1 if movement else 0
+        )
+        if position:
+            args += (position.x, position.y, position.z, position.length)
+        if movement:
+            args += (movement.x, movement.y, movement.z, movement.length)
+        # Actions as one byte each and offsets as floats, both with a 4-byte length prefix
+        if actions:
+            return packer, args + (len(actions), bytes([action.value for action in actions]), len(self.action_offsets), *self.action_offsets)
+        return packer, args + (0, 0)
+
+    def to_bytes(self) -> bytes:
+        packer, args = self.__pack_args()
+        if self.match_time is not None:
+            return packer.pack(*args) + MATCH_TIME_STRUCT.pack(self.match_time)
+        return packer.pack(*args)
 
     @staticmethod
     def from_bytes(data: bytes):
-        offset = 0
-        fmt = "B i i B f B f B"
-        fixed_size = struct.calcsize(fmt)
-        values = struct.unpack(fmt, data[:fixed_size])
-        offset += fixed_size
-
-        pos_flag, health, enemy_health, look_flag, look_rotation, body_flag, body_rotation, move_flag = values
-        pos = Vector.from_bytes(data[offset:offset+16]) if pos_flag else None
-        offset += 16 if pos_flag else 0
-
-        move = Vector.from_bytes(data[offset:offset+16]) if move_flag else None
-        offset += 16 if move_flag else 0
-
-        actions_len = struct.unpack("I", data[offset:offset+4])[0]
-        offset += 4
-        actions = [
-            PlayerAction(struct.unpack("B", data[offset+i:offset+i+1])[0]) 
-            for i in range(actions_len)
-        ]
-        offset += actions_len
-
-        offsets_len = struct.unpack("I", data[offset:offset+4])[0]
-        offset += 4
-        action_offsets = list(struct.unpack(f"{offsets_len}f", data[offset:offset + 4 * offsets_len]))
-        offset += 4 * offsets_len
+        pos_flag, health, enemy_health, look_flag, look_rotation, body_flag, body_rotation, move_flag = HEADER_STRUCT.unpack_from(data)
+        offset = HEADER_STRUCT.size
+        offset += VECTOR_STRUCT.size if pos_flag else 0
+        offset += VECTOR_STRUCT.size if move_flag else 0
+        actions_len = LENGTH_STRUCT.unpack_from(data, offset)[0]
+
+        packer = packet_struct(bool(pos_flag), bool(move_flag), actions_len)
+        values = packer.unpack_from(data)
+        match_time = None
+        if len(data) >= packer.size + MATCH_TIME_STRUCT.size:
+            match_time = MATCH_TIME_STRUCT.unpack_from(data, packer.size)[0]
+        index = 8
+        pos = None
+        if pos_flag:
+            pos = Vector(*values[index:index + 4])
+            index += 4
+        move = None
+        if move_flag:
+            move = Vector(*values[index:index + 4])
+            index += 4
+
+        actions = []
+        action_offsets = []
+        if actions_len:
+            actions = [ACTION_LOOKUP[value] for value in values[index + 1]]
+            if None in actions:
+                raise ValueError("Unknown action in payload")
+            index += 1
+            action_offsets = list(values[index + 2:])
+        if values[index + 1] != actions_len:
+            raise ValueError("Action and offset count differ")
 
         return PlayerInfo(
             position=pos,
@@ -120,7 +156,8 @@ class PlayerInfo:
             bodyRotation=body_rotation if body_flag else None,
             movement=move,
             actions=actions,
-            action_offsets=action_offsets
+            action_offsets=action_offsets,
+            match_time=match_time
         )
 
     def __safe_hash__(self, val: Vector | None) -> int:
@@ -139,6 +176,69 @@ class PlayerInfo:
         hash += int(self.health)
         return hash
 
+class RawPlayerInfo(NamedTuple):
+    """An encoded PlayerInfo together with the few values needed to relay it"""
+    data: bytes
+    health: int
+    actions_offset: int
+    action_count: int
+
+def peek_player_info(data: bytes) -> RawPlayerInfo:
+    """Read health and the action section bounds without decoding, raises ValueError on malformed framing"""
+    if len(data) < PEEK_STRUCT.size:
+        raise ValueError("Payload shorter than header")
+    pos_flag, health, move_flag = PEEK_STRUCT.unpack_from(data)
+    actions_offset = HEADER_STRUCT.size
+    actions_offset += VECTOR_STRUCT.size if pos_flag else 0
+    actions_offset += VECTOR_STRUCT.size if move_flag else 0
+    if len(data) < actions_offset + LENGTH_STRUCT.size:
+        raise ValueError("Payload truncated before actions")
+    action_count = LENGTH_STRUCT.unpack_from(data, actions_offset)[0]
+    offsets_offset = actions_offset + LENGTH_STRUCT.size + action_count
+    # Either ends after the offsets or carries the match time trailer
+    if len(data) - (offsets_offset + LENGTH_STRUCT.size + 4 * action_count) not in (0, MATCH_TIME_STRUCT.size):
+        raise ValueError("Payload length does not match action count")
+    if LENGTH_STRUCT.unpack_from(data, offsets_offset)[0] != action_count:
+        raise ValueError("Action and offset count differ")
+    return RawPlayerInfo(data, health, actions_offset, action_count)
+
+def merge_player_info(old: RawPlayerInfo, new: RawPlayerInfo) -> RawPlayerInfo:
+    """State of new with the actions of old prepended, spliced on the raw bytes"""
+    if old.action_count == 0:
+        return new
+    old_view = memoryview(old.data)
+    new_view = memoryview(new.data)
+    old_actions = old.actions_offset + LENGTH_STRUCT.size
+    new_actions = new.actions_offset + LENGTH_STRUCT.size
+    old_offsets = old_actions + old.action_count + LENGTH_STRUCT.size
+    new_offsets = new_actions + new.action_count + LENGTH_STRUCT.size
+    count = LENGTH_STRUCT.pack(old.action_count + new.action_count)
+    data = b"".join((
+        new_view[:new.actions_offset],
+        count,
+        old_view[old_actions:old_actions + old.action_count],
+        new_view[new_actions:new_actions + new.action_count],
+        count,
+        old_view[old_offsets:old_offsets + 4 * old.action_count],
+        # Offsets of new plus its match time trailer, if any
+        new_view[new_offsets:],
+    ))
+    return RawPlayerInfo(data, new.health, new.actions_offset, old.action_count + new.action_count)
+
+def coalesce_player_info(older: PlayerInfo, newer: PlayerInfo) -> PlayerInfo:
+    """One update with the same effect as applying older and then newer: newest transform, all actions, lowest health"""
+    return PlayerInfo(
+        position=newer.position if newer.position is not None else older.position,
+        health=min(older.health, newer.health),
+        enemy_health=min(older.enemy_health, newer.enemy_health),
+        lookRotation=newer.lookRotation if newer.lookRotation is not None else older.lookRotation,
+        bodyRotation=newer.bodyRotation if newer.bodyRotation is not None else older.bodyRotation,
+        movement=newer.movement if newer.movement is not None else older.movement,
+        actions=older.actions + newer.actions,
+        action_offsets=older.action_offsets + newer.action_offsets,
+        match_time=newer.match_time if newer.match_time is not None else older.match_time
+    )
+
 if __name__ == "__main__":
     import json
     from dataclasses import asdict
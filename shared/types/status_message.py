@@ -10,6 +10,9 @@ class StatusMessages(Enum):
     LOBBY_WAITING = "lobby_waiting"
     TERMINATED = "terminated"
     LOBBY_STARTING = "lobby_starting"
+    # Latency measurement, sent by both sides, detail holds the sequence number the pong has to echo
+    PING = "ping"
+    PONG = "pong"
 
 @dataclass
 class GameStatus:
@@ -0,0 +1,85 @@
+from typing import Dict, List
+
+# Upper bounds of the round trip histogram buckets, the last bucket catches everything above
+RTT_HISTOGRAM_BUCKETS_MS = (10, 25, 50, 75, 100, 150, 200, 300, 500, 1000)
+# Smoothing factors as used by TCP (srtt) and RTP (jitter)
+RTT_SMOOTHING = 1 / 8
+JITTER_SMOOTHING = 1 / 16
+
+class LatencyTracker:
+    """
+    Round trip statistics from ping/pong pairs identified by a sequence number.
+    Keeps a smoothed rtt, the smoothed variation between consecutive samples (jitter),
+    the share of pings that were not answered in time and a histogram of all samples.
+    """
+    __slots__ = ("timeout_s", "buckets_ms", "histogram", "pending", "next_sequence", "rtt_s", "last_rtt_s", "jitter_s", "sent", "received", "lost")
+
+    def __init__(self, timeout_s: float, buckets_ms=RTT_HISTOGRAM_BUCKETS_MS) -> None:
+        self.timeout_s = timeout_s
+        self.buckets_ms = buckets_ms
+        self.histogram: List[int] = [0] * (len(buckets_ms) + 1)
+        # Sequence number -> send time of pings still waiting for their pong
+        self.pending: Dict[int, float] = dict()
+        self.next_sequence = 0
+        self.rtt_s: float | None = None
+        self.last_rtt_s: float | None = None
+        self.jitter_s = 0.0
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+
+    def next_ping(self, now: float) -> int:
+        """Register a ping sent now, returns the sequence number to send along"""
+        self.expire(now)
+        sequence = self.next_sequence
+        self.next_sequence += 1
+        self.pending[sequence] = now
+        self.sent += 1
+        return sequence
+
+    def record_pong(self, sequence: int, now: float) -> float | None:
+        """Round trip of the answered ping, None for unknown, duplicate or already expired pings"""
+        if (sent_at := self.pending.pop(sequence, None)) is None:
+            return None
+        rtt = now - sent_at
+        self.received += 1
+        if self.rtt_s is None:
+            self.rtt_s = rtt
+        else:
+            self.rtt_s += (rtt - self.rtt_s) * RTT_SMOOTHING
+        if self.last_rtt_s is not None:
+            self.jitter_s += (abs(rtt - self.last_rtt_s) - self.jitter_s) * JITTER_SMOOTHING
+        self.last_rtt_s = rtt
+        self.histogram[self.__bucket(rtt * 1000)] += 1
+        return rtt
+
+    def expire(self, now: float):
+        """Count pings without answer after the timeout as lost"""
+        for sequence, sent_at in list(self.pending.items()):
+            if now - sent_at > self.timeout_s:
+                del self.pending[sequence]
+                self.lost += 1
+
+    def loss_ratio(self) -> float:
+        answered_or_lost = self.received + self.lost
+        return self.lost / answered_or_lost if answered_or_lost > 0 else 0.0
+
+    def __bucket(self, rtt_ms: float) -> int:
+        for index, upper_bound in enumerate(self.buckets_ms):
+            if rtt_ms <= upper_bound:
+                return index
+        return len(self.buckets_ms)
+
+    def summary(self) -> dict:
+        return {
+            "rtt_ms": round(self.rtt_s * 1000, 2) if self.rtt_s is not None else None,
+            "jitter_ms": round(self.jitter_s * 1000, 2),
+            "loss": round(self.loss_ratio(), 4),
+            "sent": self.sent,
+            "received": self.received,
+            "lost": self.lost,
+            "histogram_ms": {
+                **{f"le_{bound}": count for bound, count in zip(self.buckets_ms, self.histogram)},
+                "inf": self.histogram[-1],
+            },
+        }
@@ -41,6 +41,14 @@ class LogFormatter(logging.Formatter):
             + Color.ENDC
         )
 
+class IdLoggerAdapter(logging.LoggerAdapter):
+    """
+    Prefixes messages with the id of the object logging them.
+    Named loggers per object are never freed by the logging module, adapters are.
+    """
+    def process(self, msg, kwargs):
+        return f"[{self.extra['id']}] {msg}", kwargs
+
 
 def init_logger() -> None:
     """Set the LogFormatter as a formatter for the global logger"""
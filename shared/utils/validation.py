@@ -2,7 +2,8 @@ from enum import Enum
 import json
 import uuid
 
-from shared.types.player_info import PlayerInfo
+from shared.types.player_delta import is_delta_packet, merge_delta, peek_delta
+from shared.types.player_info import PlayerInfo, RawPlayerInfo, merge_player_info, peek_player_info
 from shared.types.status_message import GameStatus
 
 def is_valid_uuid(uuid_to_test, version=4) -> bool:
@@ -20,6 +21,23 @@ def parse_player_info(raw: bytes) -> PlayerInfo | None:
     except Exception:
         return None
 
+def parse_raw_player_info(raw: bytes, last_health: int = 1) -> RawPlayerInfo | None:
+    """Full or delta packet, deltas without a health field keep last_health"""
+    try:
+        if is_delta_packet(raw):
+            return peek_delta(raw, last_health)
+        return peek_player_info(raw)
+    except Exception:
+        return None
+
+def merge_raw_player_info(old: RawPlayerInfo, new: RawPlayerInfo) -> RawPlayerInfo | None:
+    """Coalesce two pending packets of one sender, None if they use different encodings"""
+    if is_delta_packet(old.data) != is_delta_packet(new.data):
+        return None
+    if is_delta_packet(new.data):
+        return merge_delta(old, new)
+    return merge_player_info(old, new)
+
 def parse_game_status(raw: str) -> GameStatus | None:
     try:
         res = GameStatus(**json.loads(raw))